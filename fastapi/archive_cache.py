@@ -0,0 +1,90 @@
+import hashlib
+import os
+import threading
+import uuid
+from pathlib import Path
+
+from zipstream import directory_entries, stream_zip
+
+
+class ArchiveCache:
+    """Disk cache of the zip archives of tracking runs.
+
+    Archives are content addressed: the file name contains a hash of the names,
+    sizes and modification times of the files in the run directory, so an archive
+    is rebuilt only when the run changes. Serving an archive marks it as recently
+    used. When the cache grows beyond `max_bytes`, the least recently used
+    archives are deleted.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()  # serializes eviction
+
+    def get(self, run_path):
+        # Cached archive of the current state of the run directory, or None
+        path = self._archive_path(run_path)
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            return None
+        return path
+
+    def build(self, run_path):
+        run_path = Path(run_path)
+        path = self._archive_path(run_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as f:
+            for chunk in stream_zip(directory_entries(run_path)):
+                f.write(chunk)
+        os.replace(tmp_path, path)  # atomic, concurrent builds of the same archive are harmless
+
+        # Remove archives of older states of this run, then enforce the disk budget
+        for stale in path.parent.glob(f"{run_path.name}_*.zip"):
+            if stale != path:
+                stale.unlink(missing_ok=True)
+        self.evict(keep=path)
+        return path
+
+    def get_or_build(self, run_path):
+        return self.get(run_path) or self.build(run_path)
+
+    def open(self, run_path, retries=3):
+        # Open binary file of the cached archive. The open file stays readable if the archive is evicted by a
+        # concurrent build while it is served, an archive evicted before it is opened is built again
+        for i in range(retries):
+            try:
+                return open(self.get_or_build(run_path), "rb")
+            except FileNotFoundError:
+                if i == retries - 1:
+                    raise
+
+    def evict(self, keep=None):
+        with self._lock:
+            archives = []
+            for path in self.cache_dir.rglob("*.zip"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                archives.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in archives)
+            for _, size, path in sorted(archives):  # least recently used first
+                if total <= self.max_bytes:
+                    break
+                if path != keep:
+                    path.unlink(missing_ok=True)
+                    total -= size
+
+    def _archive_path(self, run_path):
+        run_path = Path(run_path)
+        fingerprint = hashlib.sha1()
+        with os.scandir(run_path) as it:
+            for entry in sorted(it, key=lambda entry: entry.name):
+                if entry.is_file():
+                    stat = entry.stat()
+                    fingerprint.update(f"{entry.name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+        # One sub directory per date, named <tracking run>_<content hash>.zip
+        return Path(self.cache_dir, run_path.parent.name, f"{run_path.name}_{fingerprint.hexdigest()[:16]}.zip")
@@ -0,0 +1,217 @@
+"""
+Benchmark the classify pipeline stage by stage and compare the results between commits.
+
+For every model, backend and thread count, the model is loaded once and each batch size
+is then run on crops of a directory (i.e. data/<date>/<run>/) or on synthetic crops:
+- load: seconds to load the model, including the warmup run of the classifier
+- warmup: milliseconds of the first batch of each batch size
+- preprocess: decoding and preprocessing, ms per image
+- inference: forward pass and softmax, ms per image
+- postprocess: aggregation of the probabilities into the result of a run, ms per image
+The backend follows the weights: ONNX (*.onnx) is run by the lean ONNX Runtime path of
+the server, PyTorch (*.pt), TorchScript (*.torchscript) and OpenVINO (*_openvino_model/)
+by DetectMultiBackend. With --yolov5, ONNX models are also run by DetectMultiBackend.
+Thread counts set the intra-op threads of ONNX Runtime and torch.set_num_threads(),
+0 keeps the default of one thread per core.
+
+The report is written as JSON (--output). With --compare, the per image medians are
+compared with a former report and the exit code is 1 if a stage got slower by more than
+--tolerance, so the benchmark can guard a change against regressions.
+
+Usage (from the fastapi directory):
+    $ python -m benchmarks.classify_pipeline --output before.json
+    $ python -m benchmarks.classify_pipeline --compare before.json --output after.json
+    $ python -m benchmarks.classify_pipeline --weights model.onnx model.pt --batch-sizes 1 8 32 --threads 1 2
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks.decode_threads import load_crops
+from classification import DEFAULT_WEIGHTS, TorchClassifier, aggregate_predictions, load_classifier
+from onnx_classifier import Preprocessor, decode
+from onnx_session import SessionProfile
+
+STAGES = ("preprocess", "inference", "postprocess")
+NOISE_MS = 0.01  # slowdowns of less than this per image are not regressions, i.e. of the aggregation
+
+
+def backend(weights):
+    # Backend name of the weights, as the model formats of export.py
+    weights = Path(weights)
+    if weights.name.endswith("_openvino_model") or weights.suffix == ".xml":
+        return "openvino"
+    return {".pt": "pytorch", ".torchscript": "torchscript", ".onnx": "onnx"}.get(weights.suffix, weights.suffix[1:])
+
+
+def environment():
+    # Versions and hardware the report was measured on
+    try:
+        commit = subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    versions = {}
+    for module in ("numpy", "cv2", "onnxruntime", "torch", "openvino"):
+        if module in sys.modules:
+            versions[module] = getattr(sys.modules[module], "__version__", None)
+    return {
+        "commit": commit,
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cores": os.cpu_count(),
+        "versions": versions,
+    }
+
+
+def load(weights, imgsz, threads, yolov5=False):
+    # Classifier for a backend and thread count
+    session_options = SessionProfile(intra_op_threads=threads, inter_op_threads=1 if threads else 0).session_options()
+    if yolov5 or backend(weights) != "onnx":
+        import torch
+
+        torch.set_num_threads(threads or os.cpu_count() or 1)  # also resets a former thread count
+        return TorchClassifier(weights, imgsz=imgsz, session_options=session_options)
+    return load_classifier(weights, imgsz=imgsz, session_options=session_options)
+
+
+def summary(times, n):
+    # Median and p90 in ms per image of the batch times in seconds
+    per_image = sorted(t * 1000 / n for t in times)
+    p90 = statistics.quantiles(per_image, n=10)[-1] if len(per_image) > 1 else per_image[0]
+    return {"p50": statistics.median(per_image), "p90": p90}
+
+
+def measure(model, crops, batch_size, iterations):
+    # Stage times per image of a batch size, and the milliseconds of its first batch
+    crops = [crops[i % len(crops)] for i in range(batch_size)]
+    preprocessor = Preprocessor(model.imgsz, max_batch=batch_size)
+    start = time.perf_counter()
+    model.classify(preprocessor([decode(crop) for crop in crops]), batch_size)
+    warmup_ms = (time.perf_counter() - start) * 1000
+
+    times = {stage: [] for stage in STAGES}
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        batch = preprocessor([decode(crop) for crop in crops])
+        t1 = time.perf_counter()
+        pred = model.classify(batch, batch_size)
+        t2 = time.perf_counter()
+        aggregate_predictions(pred, model.names)
+        t3 = time.perf_counter()
+        times["preprocess"].append(t1 - t0)
+        times["inference"].append(t2 - t1)
+        times["postprocess"].append(t3 - t2)
+    stages = {stage: summary(times[stage], batch_size) for stage in STAGES}
+    total = sum(stages[stage]["p50"] for stage in STAGES)
+    return {"warmup_ms": warmup_ms, **stages, "images_per_s": 1000 / total}
+
+
+def run(
+    weights=(DEFAULT_WEIGHTS,),
+    source=None,
+    imgsz=128,
+    batch_sizes=(1, 8, 32),
+    threads=(0,),
+    iterations=20,
+    yolov5=False,
+    output=None,
+    compare=None,
+    tolerance=0.1,
+):
+    crops = load_crops(source)
+    if not crops:
+        sys.exit(f"No images found in {source}")
+    configs = [(w, False) for w in weights]
+    if yolov5:
+        configs += [(w, True) for w in weights if backend(w) == "onnx"]
+
+    results = []
+    for w, via_yolov5 in configs:
+        for n in threads:
+            start = time.perf_counter()
+            model = load(w, imgsz, n, via_yolov5)
+            load_s = time.perf_counter() - start
+            for batch_size in batch_sizes:
+                result = {
+                    "model": Path(w).name,
+                    "backend": f"{backend(w)}-yolov5" if via_yolov5 else backend(w),
+                    "threads": n,
+                    "batch_size": batch_size,
+                    "load_s": load_s,
+                    **measure(model, crops, batch_size, iterations),
+                }
+                results.append(result)
+                print_result(result)
+
+    report = {"environment": environment(), "images": len(crops), "iterations": iterations, "results": results}
+    if output:
+        Path(output).write_text(json.dumps(report, indent=2))
+        print(f"Report saved to {output}")
+    if compare:
+        return compare_reports(json.loads(Path(compare).read_text()), report, tolerance)
+    return True
+
+
+def print_result(r):
+    print(
+        f"{r['model']} {r['backend']} threads={r['threads']} bs={r['batch_size']}: load {r['load_s']:.2f}s, "
+        f"warmup {r['warmup_ms']:.1f}ms, per image p50 (p90) "
+        + ", ".join(f"{stage} {r[stage]['p50']:.3f} ({r[stage]['p90']:.3f})ms" for stage in STAGES)
+        + f", {r['images_per_s']:.0f} img/s"
+    )
+
+
+def compare_reports(baseline, report, tolerance=0.1):
+    # Print the change of the per image medians, False if a stage is slower by more than tolerance
+    def key(r):
+        return r["model"], r["backend"], r["threads"], r["batch_size"]
+
+    former = {key(r): r for r in baseline["results"]}
+    print(f"\nCompared with {baseline['environment'].get('commit')} (tolerance {tolerance:.0%})")
+    regressions = []
+    for r in report["results"]:
+        old = former.get(key(r))
+        if old is None:
+            continue
+        changes = []
+        for stage in STAGES:
+            change = r[stage]["p50"] / old[stage]["p50"] - 1 if old[stage]["p50"] else 0.0
+            changes.append(f"{stage} {change:+.1%}")
+            if change > tolerance and r[stage]["p50"] - old[stage]["p50"] > NOISE_MS:
+                regressions.append(f"{' '.join(map(str, key(r)))} {stage} {change:+.1%}")
+        print(f"{' '.join(map(str, key(r)))}: " + ", ".join(changes))
+    if not any(key(r) in former for r in report["results"]):
+        print("No results of the same model, backend, threads and batch size to compare")
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    return not regressions
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weights", nargs="+", default=[DEFAULT_WEIGHTS], help="model paths, any backend")
+    parser.add_argument("--source", type=str, help="image directory, i.e. data/<date>/<run>/, default synthetic crops")
+    parser.add_argument("--imgsz", type=int, default=128, help="inference size")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32], help="batch sizes")
+    parser.add_argument("--threads", nargs="+", type=int, default=[0], help="inference thread counts, 0 is default")
+    parser.add_argument("--iterations", type=int, default=20, help="timed runs per batch size")
+    parser.add_argument("--yolov5", action="store_true", help="also run ONNX models by DetectMultiBackend")
+    parser.add_argument("--output", type=str, help="JSON report path")
+    parser.add_argument("--compare", type=str, help="JSON report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed slowdown per stage, 0.1 is 10%%")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(**vars(parse_opt())) else 1)
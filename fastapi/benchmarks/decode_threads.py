@@ -0,0 +1,105 @@
+"""
+Benchmark crops/s of decoding and resizing with PrefetchLoader against its number of threads.
+
+The crops are JPEGs of a directory (i.e. data/<date>/<run>/) or synthetic ones, held in
+memory as in /classify. For each thread count, the whole set is decoded into batches:
+- decode only: the batches are drained as fast as possible
+- with inference (--weights): every batch is classified by the model, so decoding the next
+  batches overlaps with the forward pass, as in the server
+0 threads is the former path, all images decoded in the calling thread before inference.
+
+Usage (from the fastapi directory):
+    $ python -m benchmarks.decode_threads
+    $ python -m benchmarks.decode_threads --source data/2024-05-10/ --weights path/to/model.onnx --threads 0 1 2 4
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from image_loader import PrefetchLoader
+from onnx_classifier import Preprocessor, decode
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def load_crops(source=None, n=256, size=(240, 320)):
+    # Encoded images of a directory, or n synthetic JPEG crops
+    if source:
+        return [p.read_bytes() for p in sorted(Path(source).rglob("*")) if p.suffix.lower() in IMAGE_SUFFIXES]
+    rng = np.random.default_rng(0)
+    crops = []
+    for _ in range(n):
+        im = cv2.GaussianBlur(rng.integers(0, 256, (*size, 3), dtype=np.uint8), (9, 9), 0)  # compresses like a photo
+        crops.append(cv2.imencode(".jpg", im, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes())
+    return crops
+
+
+def crops_per_s(fn, n, iterations):
+    # Median crops/s of fn() over n crops
+    fn()  # warmup
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return n / statistics.median(times)
+
+
+def run(source=None, weights=None, imgsz=128, threads=(0, 1, 2, 4), prefetch=2, batch_size=32, iterations=5):
+    crops = load_crops(source)
+    if not crops:
+        sys.exit(f"No images found in {source}")
+    model = None
+    if weights:
+        from classification import load_classifier
+
+        model = load_classifier(weights, imgsz=imgsz)
+        imgsz = model.imgsz
+    imgsz = (imgsz, imgsz) if isinstance(imgsz, int) else tuple(imgsz)
+    classify = model.classify if model else lambda batch, max_batch: None
+
+    print(f"{len(crops)} crops, batch size {batch_size}, prefetch {prefetch}, inference {'on' if model else 'off'}")
+    print(f"{'threads':>8} | {'crops/s':>10} | {'speedup':>8}")
+    baseline = None
+    for n in threads:
+        if n:
+            loader = PrefetchLoader(threads=n, prefetch=prefetch, batch_size=batch_size)
+
+            def fn():
+                for batch in loader(crops, imgsz):
+                    classify(batch, batch_size)
+
+        else:
+            preprocessor = Preprocessor(imgsz)
+
+            def fn():
+                batch = preprocessor([decode(crop) for crop in crops])
+                for i in range(0, len(batch), batch_size):
+                    classify(batch[i : i + batch_size], batch_size)
+
+        rate = crops_per_s(fn, len(crops), iterations)
+        if n:
+            loader.close()
+        baseline = baseline or rate
+        print(f"{n:>8} | {rate:>10.0f} | {rate / baseline:>7.2f}x")
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", type=str, help="image directory, i.e. data/<date>/<run>/, default synthetic crops")
+    parser.add_argument("--weights", type=str, help="classify the batches with this model, default decode only")
+    parser.add_argument("--imgsz", type=int, default=128, help="inference size")
+    parser.add_argument("--threads", nargs="+", type=int, default=[0, 1, 2, 4], help="thread counts, 0 is serial")
+    parser.add_argument("--prefetch", type=int, default=2, help="batches decoded ahead")
+    parser.add_argument("--batch-size", type=int, default=32, help="images per batch")
+    parser.add_argument("--iterations", type=int, default=5, help="timed runs per thread count")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run(**vars(parse_opt()))
@@ -0,0 +1,461 @@
+"""
+Load test of the /classify ingest path: how many concurrent camera uploads does the server sustain?
+
+Starts server.py locally (hypercorn as in the Dockerfile, or uvicorn) in a temporary working
+directory with a stub API key, then replays tracking run uploads as a camera sends them:
+multipart JPEG crops with start_date, end_date and duration_s. The crops are synthetic, and if
+the model weights are missing a small synthetic ONNX model with the same input and metadata is
+used, so the test runs offline and without data. Every level runs for --duration seconds:
+- closed loop (default): --concurrency cameras, each uploading its next run as soon as the
+  former one was answered
+- open loop (--rate): runs arrive at random (Poisson) with the given mean rate per second, at
+  most --concurrency at once; latency is measured from the arrival, so it includes waiting for
+  a free connection when the server falls behind
+Each level reports the p50/p95/p99 latency, the throughput in runs and crops per second, the
+error rate and the resident memory (VmRSS) of the server and its worker processes. With
+INGEST_MODE=queue (--env), the time until the queued job is done is reported as well. With
+--max-error-rate, the exit code is 1 if a level has more errors, so the test can run as a check.
+
+Usage (from the fastapi directory):
+    $ python -m benchmarks.load_test --concurrency 1 2 4 8
+    $ python -m benchmarks.load_test --rate 0.5 1 2 --concurrency 16 --duration 60 --output load.json
+    $ python -m benchmarks.load_test --env INGEST_MODE=queue INFERENCE_WORKERS=2 --concurrency 4
+    $ python -m benchmarks.load_test --env INFERENCE_WORKERS=1 --imgsz 96 --duration 5 --max-error-rate 0
+    $ python -m benchmarks.load_test --url http://localhost:8000 --api-key <key>  # running server
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+FASTAPI_ROOT = Path(__file__).resolve().parents[1]
+API_KEY = "load-test"
+NAMES = {0: "ant", 1: "bee", 2: "beetle", 3: "fly", 4: "none_bg", 5: "none_dirt", 6: "none_shadow", 7: "wasp"}
+
+
+def synthetic_model(path, imgsz=128):
+    # Small ONNX classifier with the input, output and metadata of an export.py model, random weights
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    rng = np.random.default_rng(0)
+    weights = {
+        "w1": rng.normal(0, 0.3, (16, 3, 3, 3)).astype(np.float32),
+        "b1": np.zeros(16, np.float32),
+        "w2": rng.normal(0, 1, (16, len(NAMES))).astype(np.float32),
+        "b2": rng.normal(0, 0.1, len(NAMES)).astype(np.float32),
+    }
+    nodes = [
+        helper.make_node("Conv", ["images", "w1", "b1"], ["conv"], kernel_shape=[3, 3], strides=[2, 2], pads=[1] * 4),
+        helper.make_node("Relu", ["conv"], ["relu"]),
+        helper.make_node("GlobalAveragePool", ["relu"], ["pool"]),
+        helper.make_node("Flatten", ["pool"], ["flat"]),
+        helper.make_node("MatMul", ["flat", "w2"], ["matmul"]),
+        helper.make_node("Add", ["matmul", "b2"], ["output0"]),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "synthetic-classifier",
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, ["batch", 3, imgsz, imgsz])],
+        [helper.make_tensor_value_info("output0", TensorProto.FLOAT, ["batch", len(NAMES)])],
+        [numpy_helper.from_array(v, k) for k, v in weights.items()],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8  # readable by older onnxruntime versions
+    for key, value in {"stride": 32, "names": NAMES}.items():
+        model.metadata_props.add(key=key, value=str(value))
+    onnx.save(model, path)
+    return Path(path)
+
+
+def synthetic_runs(n=32, crops=(4, 40), seed=0):
+    # Tracking runs [[(filename, JPEG bytes), ...], ...] of crops with sizes as cropped from the camera frames
+    rng = np.random.default_rng(seed)
+    runs = []
+    for _ in range(n):
+        run = []
+        for i in range(rng.integers(crops[0], crops[1] + 1)):
+            h, w = rng.integers(60, 400, 2)
+            im = cv2.GaussianBlur(rng.integers(0, 256, (h, w, 3), dtype=np.uint8), (9, 9), 0)
+            run.append((f"crop_{i:03d}.jpg", cv2.imencode(".jpg", im, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()))
+        runs.append(run)
+    return runs
+
+
+def multipart(fields, files):
+    # multipart/form-data body and content type of form fields and files [(filename, bytes), ...]
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for filename, content in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+            f"Content-Type: image/jpeg\r\n\r\n".encode()
+        )
+        parts += [content, b"\r\n"]
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class Server:
+    """server.py started by hypercorn or uvicorn in a temporary working directory."""
+
+    def __init__(self, weights, env=None, server="hypercorn", port=None):
+        self.port = port or free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._cwd = tempfile.TemporaryDirectory(prefix="load-test-")
+        env = {
+            **os.environ,
+            "PYTHONPATH": os.pathsep.join(filter(None, [str(FASTAPI_ROOT), os.getenv("PYTHONPATH")])),
+            "API_KEY": API_KEY,
+            "MODEL_WEIGHTS": str(weights),
+            **(env or {}),
+        }
+        bind = {
+            "hypercorn": ["-m", "hypercorn", "server:app", "--bind", f"127.0.0.1:{self.port}"],
+            "uvicorn": ["-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(self.port)],
+        }[server]
+        self.log = open(Path(self._cwd.name, "server.log"), "wb")
+        self.process = subprocess.Popen(
+            [sys.executable, *bind], cwd=self._cwd.name, env=env, stdout=self.log, stderr=subprocess.STDOUT
+        )
+
+    def wait_ready(self, timeout=120):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with {self.process.returncode}:\n{self.output()}")
+            try:
+                get(self.url, "/metrics/inference", API_KEY)
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise TimeoutError(f"Server not ready after {timeout}s:\n{self.output()}")
+
+    def output(self):
+        self.log.flush()
+        return Path(self.log.name).read_text(errors="replace")[-4000:]
+
+    def stop(self):
+        self.process.send_signal(signal.SIGINT)
+        try:
+            self.process.wait(30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+        self._cwd.cleanup()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_tree(pid):
+    # pid and the pids of all its descendants, i.e. inference pool workers
+    pids = [pid]
+    for p in pids:
+        for task in Path(f"/proc/{p}/task").glob("*"):
+            try:
+                pids += [int(c) for c in (task / "children").read_text().split()]
+            except OSError:
+                pass
+    return pids
+
+
+def rss_mb(pid):
+    # Resident memory of a process and its descendants in MB, None where /proc is not available
+    total = 0
+    for p in process_tree(pid):
+        try:
+            status = dict(line.split(":", 1) for line in Path(f"/proc/{p}/status").read_text().splitlines())
+            total += int(status["VmRSS"].split()[0])
+        except (OSError, KeyError):
+            pass
+    return total / 1024 if total else None
+
+
+class MemorySampler(threading.Thread):
+    # Samples the RSS of the server process tree in the background
+    def __init__(self, pid, interval=0.25):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            mb = rss_mb(self.pid)
+            if mb is not None:
+                self.samples.append(mb)
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        return {
+            "rss_mean_mb": statistics.mean(self.samples) if self.samples else None,
+            "rss_peak_mb": max(self.samples, default=None),
+        }
+
+
+def get(url, path, api_key, timeout=10):
+    request = urllib.request.Request(url + path, headers={"access_token": api_key})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def upload(url, api_key, tracking_id, run, timeout=120):
+    # POST one tracking run, returns the HTTP status and the response body (None on a connection error)
+    end = datetime(2024, 5, 10, 12) + timedelta(seconds=tracking_id)  # unique run directory per upload
+    duration_s = max(len(run), 1) * 3
+    fields = {
+        "start_date": (end - timedelta(seconds=duration_s)).isoformat(),
+        "end_date": end.isoformat(),
+        "duration_s": duration_s,
+    }
+    body, content_type = multipart(fields, run)
+    request = urllib.request.Request(
+        f"{url}/classify/{tracking_id}",
+        data=body,
+        headers={"access_token": api_key, "Content-Type": content_type},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+    except OSError:
+        return None, None
+
+
+def wait_job(url, api_key, status_url, timeout=300):
+    # Poll a queued job until it is done or failed, returns its final status
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            job = get(url, status_url, api_key)
+        except OSError:
+            return "error"
+        if job["status"] in ("done", "failed"):
+            return job["status"]
+        time.sleep(0.05)
+    return "timeout"
+
+
+class LoadGenerator:
+    """Replays tracking run uploads against a server and records the latency of every request."""
+
+    def __init__(self, url, api_key, runs, follow_jobs=True):
+        self.url = url
+        self.api_key = api_key
+        self.runs = runs
+        self.follow_jobs = follow_jobs
+        self._ids = iter(range(1, sys.maxsize))
+        self._lock = threading.Lock()
+
+    def request(self, arrival):
+        # One upload of the next run, latency from its arrival time
+        with self._lock:
+            tracking_id = next(self._ids)
+        run = self.runs[tracking_id % len(self.runs)]
+        status, body = upload(self.url, self.api_key, tracking_id, run)
+        latency = time.perf_counter() - arrival
+        result = {"status": status, "latency_s": latency, "crops": len(run)}
+        if self.follow_jobs and status == 202 and body:
+            job_status = wait_job(self.url, self.api_key, body["status_url"])
+            result.update(job_status=job_status, job_latency_s=time.perf_counter() - arrival)
+        return result
+
+    def closed_loop(self, concurrency, duration):
+        # concurrency cameras uploading back to back for duration seconds
+        deadline = time.perf_counter() + duration
+
+        def camera():
+            results = []
+            while time.perf_counter() < deadline:
+                results.append(self.request(time.perf_counter()))
+            return results
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            return [r for results in executor.map(lambda _: camera(), range(concurrency)) for r in results]
+
+    def open_loop(self, rate, concurrency, duration, seed=0):
+        # Poisson arrivals at rate per second for duration seconds, at most concurrency in flight
+        rng = random.Random(seed)
+        start = time.perf_counter()
+        futures = []
+        with ThreadPoolExecutor(concurrency) as executor:
+            arrival = start + rng.expovariate(rate)
+            while arrival < start + duration:
+                time.sleep(max(arrival - time.perf_counter(), 0))
+                futures.append(executor.submit(self.request, arrival))
+                arrival += rng.expovariate(rate)
+        return [future.result() for future in futures]
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+def succeeded(result):
+    # 2xx response, and for a queued job also a successful classification
+    return result["status"] is not None and 200 <= result["status"] < 300 and result.get("job_status", "done") == "done"
+
+
+def summarize(results, elapsed):
+    ok = [r for r in results if succeeded(r)]
+    latencies = [r["latency_s"] * 1000 for r in ok]
+    summary = {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+        "status": {str(s): sum(r["status"] == s for r in results) for s in {r["status"] for r in results}},
+        "runs_per_s": len(ok) / elapsed,
+        "crops_per_s": sum(r["crops"] for r in ok) / elapsed,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies, default=None),
+    }
+    jobs = [r["job_latency_s"] * 1000 for r in ok if "job_latency_s" in r]
+    if jobs:
+        summary.update({f"job_p{q}_ms": percentile(jobs, q) for q in (50, 95, 99)})
+    return summary
+
+
+def fmt(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def print_summary(level, s):
+    line = (
+        f"{level:>16} | {s['requests']:>8} | {s['error_rate']:>6.1%} | "
+        f"{s['runs_per_s']:>7.2f} | {s['crops_per_s']:>7.1f} | "
+        f"{fmt(s['p50_ms'], '8.0f')} | {fmt(s['p95_ms'], '8.0f')} | {fmt(s['p99_ms'], '8.0f')} | "
+        f"{fmt(s.get('rss_peak_mb'), '8.0f')}"
+    )
+    if "job_p95_ms" in s:
+        line += f" | job p50/p95/p99 {s['job_p50_ms']:.0f}/{s['job_p95_ms']:.0f}/{s['job_p99_ms']:.0f} ms"
+    print(line)
+
+
+def run(
+    url=None,
+    api_key=API_KEY,
+    weights=None,
+    server="hypercorn",
+    env=(),
+    concurrency=(1, 2, 4, 8),
+    rate=None,
+    duration=20.0,
+    warmup=2,
+    runs=32,
+    crops=(4, 40),
+    imgsz=128,
+    output=None,
+    max_error_rate=None,
+):
+    env = dict(item.split("=", 1) for item in env)
+    dataset = synthetic_runs(runs, crops)
+    with tempfile.TemporaryDirectory() as tmp:
+        server_process = None
+        if url is None:
+            from classification import DEFAULT_WEIGHTS
+
+            weights = Path(weights or DEFAULT_WEIGHTS)
+            if not weights.exists():
+                print(f"{weights} not found, using a synthetic model")
+                weights = synthetic_model(Path(tmp, f"synthetic_imgsz{imgsz}.onnx"), imgsz)
+            server_process = Server(weights.resolve(), env, server)
+            server_process.wait_ready()
+            url = server_process.url
+        try:
+            generator = LoadGenerator(url, api_key, dataset)
+            for _ in range(warmup):
+                generator.request(time.perf_counter())  # first requests and allocations are not measured
+
+            levels = [("rate", r) for r in rate] if rate else [("concurrency", c) for c in concurrency]
+            print(f"{sum(len(r) for r in dataset) / len(dataset):.1f} crops per run, {duration:.0f}s per level, {url}")
+            print(
+                f"{'level':>16} | {'requests':>8} | {'errors':>6} | {'runs/s':>7} | {'crops/s':>7} | "
+                f"{'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'RSS MB':>8}"
+            )
+            levels_report = []
+            for kind, value in levels:
+                sampler = MemorySampler(server_process.process.pid) if server_process else None
+                if sampler:
+                    sampler.start()
+                start = time.perf_counter()
+                if kind == "rate":
+                    results = generator.open_loop(value, max(concurrency), duration)
+                else:
+                    results = generator.closed_loop(value, duration)
+                summary = summarize(results, time.perf_counter() - start)
+                if sampler:
+                    summary.update(sampler.stop())
+                print_summary(f"{kind}={value:g}", summary)
+                levels_report.append({kind: value, **summary})
+        finally:
+            if server_process:
+                server_process.stop()
+
+    report = {"url": url, "env": env, "duration_s": duration, "crops_per_run": list(crops), "levels": levels_report}
+    if output:
+        Path(output).write_text(json.dumps(report, indent=2))
+        print(f"Report saved to {output}")
+    if max_error_rate is not None:
+        failed = [level for level in levels_report if level["error_rate"] > max_error_rate]
+        for level in failed:
+            kind = "rate" if "rate" in level else "concurrency"
+            print(f"FAIL: error rate {level['error_rate']:.1%} > {max_error_rate:.1%} at {kind}={level[kind]:g}")
+        return not failed
+    return True
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", type=str, help="running server, default start server.py locally")
+    parser.add_argument("--api-key", type=str, default=API_KEY, help="API key of the running server")
+    parser.add_argument("--weights", type=str, help="model of the local server, default MODEL_WEIGHTS or synthetic")
+    parser.add_argument("--server", default="hypercorn", choices=["hypercorn", "uvicorn"], help="ASGI server")
+    parser.add_argument("--env", nargs="+", default=[], help="environment of the local server, i.e. INGEST_MODE=queue")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 2, 4, 8], help="cameras, or max in flight")
+    parser.add_argument("--rate", nargs="+", type=float, help="open loop arrival rates in runs per second")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per level")
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured uploads before the first level")
+    parser.add_argument("--runs", type=int, default=32, help="synthetic tracking runs, uploaded in turn")
+    parser.add_argument("--crops", nargs=2, type=int, default=[4, 40], help="min and max crops per run")
+    parser.add_argument("--imgsz", type=int, default=128, help="input size of the synthetic model")
+    parser.add_argument("--output", type=str, help="JSON report path")
+    parser.add_argument("--max-error-rate", type=float, help="exit with 1 if a level has more errors, i.e. 0")
+    opt = parser.parse_args()
+    if opt.weights is None and os.getenv("MODEL_WEIGHTS"):
+        opt.weights = os.getenv("MODEL_WEIGHTS")
+    return opt
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(**vars(parse_opt())) else 1)
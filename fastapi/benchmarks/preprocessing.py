@@ -0,0 +1,77 @@
+"""
+Check that the batched NumPy preprocessing of the server is identical to classify_transforms() and time both.
+
+The images are crops from a directory (i.e. data/<date>/<run>/) or random images of varying
+size. The exit code is 1 if any element of the batches differs.
+
+Usage (from the fastapi directory):
+    $ python -m benchmarks.preprocessing
+    $ python -m benchmarks.preprocessing --source data/2024-05-10/ --imgsz 128 --iterations 20
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from onnx_classifier import Preprocessor, decode
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def load_images(source=None, n=32):
+    # Decoded BGR images of a directory, or n random ones between 40 and 400 pixels
+    if source:
+        files = sorted(p for p in Path(source).rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)
+        return [decode(f.read_bytes()) for f in files]
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (*rng.integers(40, 400, 2), 3), dtype=np.uint8) for _ in range(n)]
+
+
+def timed(fn, iterations):
+    # Median milliseconds of fn()
+    fn()  # warmup
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def run(source=None, imgsz=128, iterations=20):
+    import torch
+
+    from prediction.yolov5.classify.predict import classify_transforms  # sets up the imports of prediction/yolov5
+
+    ims = load_images(source)
+    if not ims:
+        sys.exit(f"No images found in {source}")
+    transforms = classify_transforms(imgsz)
+    preprocessor = Preprocessor((imgsz, imgsz))
+
+    reference = torch.stack([transforms(im) for im in ims]).numpy()
+    batch = preprocessor(ims)
+    identical = reference.shape == batch.shape and np.array_equal(reference, batch)
+    print(f"{len(ims)} images at {imgsz}px: max abs difference {np.abs(reference - batch).max():.3g}, "
+          f"{'identical' if identical else 'NOT identical'}")
+
+    t_reference = timed(lambda: torch.stack([transforms(im) for im in ims]).numpy(), iterations)
+    t_batch = timed(lambda: preprocessor(ims), iterations)
+    print(f"classify_transforms + torch.stack: {t_reference / len(ims):.3f} ms/image")
+    print(f"Preprocessor (NumPy, preallocated): {t_batch / len(ims):.3f} ms/image ({t_reference / t_batch:.1f}x)")
+    return identical
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", type=str, help="image directory, i.e. data/<date>/<run>/, default random images")
+    parser.add_argument("--imgsz", type=int, default=128, help="inference size")
+    parser.add_argument("--iterations", type=int, default=20, help="timed runs")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(**vars(parse_opt())) else 1)
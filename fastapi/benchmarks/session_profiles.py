@@ -0,0 +1,99 @@
+"""
+Compare ONNX Runtime session settings for CPU inference of the classification model.
+
+For every configuration the session creation time (without and with the cached
+optimized graph) and the latency of batches of random images are measured.
+
+Usage (from the fastapi directory):
+    $ python -m benchmarks.session_profiles
+    $ python -m benchmarks.session_profiles --weights path/to/model.onnx --batch-sizes 1 8 32 --iterations 50
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import onnxruntime
+
+from classification import DEFAULT_WEIGHTS
+from onnx_session import GRAPH_OPTIMIZATION_LEVELS, SessionProfile
+
+
+def profiles(threads):
+    # (name, SessionProfile) of the compared configurations
+    cores = os.cpu_count() or 1
+    for level in GRAPH_OPTIMIZATION_LEVELS:
+        yield f"optimization={level}", SessionProfile(graph_optimization=level)
+    for n in sorted(set(threads or {1, max(cores // 2, 1), cores})):
+        yield f"intra_op_threads={n}", SessionProfile(intra_op_threads=n, inter_op_threads=1)
+    yield "execution_mode=parallel", SessionProfile(execution_mode="parallel")
+
+
+def create_session(path, options):
+    start = time.perf_counter()
+    session = onnxruntime.InferenceSession(str(path), sess_options=options, providers=["CPUExecutionProvider"])
+    return session, time.perf_counter() - start
+
+
+def startup_times(profile, weights, cache_dir):
+    # Seconds to create a session from the weights and from the cached optimized graph (None without cache)
+    profile.cache_dir = cache_dir
+    path = profile.cache_path(weights)
+    if path is None:
+        return create_session(weights, profile.session_options())[1], None
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.unlink(missing_ok=True)
+    _, uncached = create_session(weights, profile.session_options(optimized_model_path=path))
+    _, cached = create_session(path, profile.session_options(optimize=False))
+    return uncached, cached
+
+
+def latencies(session, batch_size, imgsz, iterations, warmup):
+    # Milliseconds per batch
+    name = session.get_inputs()[0].name
+    im = np.random.default_rng(0).random((batch_size, 3, imgsz, imgsz), dtype=np.float32)
+    for _ in range(warmup):
+        session.run(None, {name: im})
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        session.run(None, {name: im})
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def run(weights=DEFAULT_WEIGHTS, imgsz=128, batch_sizes=(1, 32), iterations=20, warmup=3, threads=None):
+    print(f"{weights}, onnxruntime {onnxruntime.__version__}, {os.cpu_count()} cores\n")
+    columns = ["config", "startup s", "cached s"]
+    for batch_size in batch_sizes:
+        columns += [f"bs{batch_size} p50 ms", f"bs{batch_size} p90 ms", f"bs{batch_size} img/s"]
+    print(" | ".join(f"{c:>24}" if i == 0 else f"{c:>12}" for i, c in enumerate(columns)))
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for name, profile in profiles(threads):
+            uncached, cached = startup_times(profile, weights, cache_dir)
+            session, _ = create_session(weights, profile.session_options())
+            row = [f"{name:>24}", f"{uncached:12.3f}", f"{cached:12.3f}" if cached is not None else f"{'-':>12}"]
+            for batch_size in batch_sizes:
+                times = latencies(session, batch_size, imgsz, iterations, warmup)
+                p50 = statistics.median(times)
+                p90 = statistics.quantiles(times, n=10)[-1] if len(times) > 1 else p50
+                row += [f"{p50:12.2f}", f"{p90:12.2f}", f"{batch_size / p50 * 1000:12.1f}"]
+            print(" | ".join(row))
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weights", type=str, default=DEFAULT_WEIGHTS, help="ONNX model path")
+    parser.add_argument("--imgsz", type=int, default=128, help="inference size")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 32], help="batch sizes")
+    parser.add_argument("--iterations", type=int, default=20, help="timed runs per batch size")
+    parser.add_argument("--warmup", type=int, default=3, help="untimed runs per batch size")
+    parser.add_argument("--threads", nargs="+", type=int, help="intra-op thread counts, default 1, cores/2, cores")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run(**vars(parse_opt()))
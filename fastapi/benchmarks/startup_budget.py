@@ -0,0 +1,94 @@
+"""
+Check the cold start of the API server against an import time, startup time and memory budget.
+
+Imports server.py and runs its startup (model loading and warmup) in a fresh interpreter,
+in a temporary working directory so no data is written next to the code, then compares:
+- seconds to import server.py and seconds of the startup
+- peak resident memory (VmHWM of /proc/self/status) in MB
+- heavy modules loaded, for ONNX weights none of torch, torchvision, matplotlib, ultralytics
+The exit code is 1 if a budget is exceeded, so the check can run in CI or before a deployment.
+
+Usage (from the fastapi directory):
+    $ python -m benchmarks.startup_budget
+    $ MODEL_WEIGHTS=path/to/model.onnx python -m benchmarks.startup_budget --max-rss-mb 300
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from checks.lean_imports import FASTAPI_ROOT, HEAVY_MODULES
+
+# Runs in the fresh interpreter, prints the measurements as JSON on the last line
+PROBE = """
+import asyncio, json, sys, time
+
+start = time.perf_counter()
+import server
+import_s = time.perf_counter() - start
+
+async def startup():
+    async with server.lifespan(server.app):
+        pass
+
+start = time.perf_counter()
+asyncio.run(startup())
+startup_s = time.perf_counter() - start
+
+status = dict(line.split(":", 1) for line in open("/proc/self/status"))
+print(json.dumps({
+    "weights": str(server.MODEL_WEIGHTS),
+    "import_s": import_s,
+    "startup_s": startup_s,
+    "rss_mb": int(status["VmRSS"].split()[0]) / 1024,
+    "peak_rss_mb": int(status["VmHWM"].split()[0]) / 1024,
+    "heavy_modules": [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def measure():
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(FASTAPI_ROOT), os.getenv("PYTHONPATH")])))
+    env.setdefault("API_KEY", "startup-budget")
+    with tempfile.TemporaryDirectory() as cwd:
+        proc = subprocess.run([sys.executable, "-c", PROBE], cwd=cwd, env=env, capture_output=True, text=True)
+    if proc.returncode:
+        sys.exit(f"Server startup failed:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def run(max_import_s=2.0, max_startup_s=5.0, max_rss_mb=400):
+    result = measure()
+    failures = []
+    if result["import_s"] > max_import_s:
+        failures.append(f"import took {result['import_s']:.2f}s > {max_import_s}s")
+    if result["startup_s"] > max_startup_s:
+        failures.append(f"startup took {result['startup_s']:.2f}s > {max_startup_s}s")
+    if result["peak_rss_mb"] > max_rss_mb:
+        failures.append(f"peak RSS {result['peak_rss_mb']:.0f} MB > {max_rss_mb} MB")
+    if Path(result["weights"]).suffix == ".onnx" and result["heavy_modules"]:
+        failures.append(f"{', '.join(result['heavy_modules'])} imported for an ONNX model")
+
+    print(
+        f"{result['weights']}: import {result['import_s']:.2f}s, startup {result['startup_s']:.2f}s, "
+        f"RSS {result['rss_mb']:.0f} MB (peak {result['peak_rss_mb']:.0f} MB), "
+        f"heavy modules: {', '.join(result['heavy_modules']) or 'none'}"
+    )
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return not failures
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-import-s", type=float, default=2.0, help="budget for importing server.py")
+    parser.add_argument("--max-startup-s", type=float, default=5.0, help="budget for loading and warming up the model")
+    parser.add_argument("--max-rss-mb", type=float, default=400, help="budget for the peak resident memory")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(**vars(parse_opt())) else 1)
@@ -0,0 +1,11 @@
+"""
+Run all checks, exits with 1 on the first failure.
+
+Usage (from the fastapi directory):
+    $ python -m checks
+"""
+from checks import lean_imports, preprocessing, scheduler
+
+if __name__ == "__main__":
+    for check in (preprocessing, scheduler, lean_imports):
+        check.main()
@@ -0,0 +1,46 @@
+"""
+Check that serving an ONNX model doesn't import torch, torchvision, matplotlib or ultralytics.
+
+Imports server.py in a fresh interpreter, in a temporary working directory so no data is written
+next to the code, with the default ONNX weights. Unlike benchmarks.startup_budget, the model is not
+loaded, so the check needs neither the weights nor onnxruntime sessions. onnxruntime itself must not
+be imported either until a model is loaded. Fails with an AssertionError (exit code 1) if one of the
+modules is imported.
+
+Usage (from the fastapi directory):
+    $ python -m checks.lean_imports
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+FASTAPI_ROOT = Path(__file__).resolve().parents[1]
+HEAVY_MODULES = ("torch", "torchvision", "matplotlib", "ultralytics")  # never imported for ONNX models
+LAZY_MODULES = ("onnxruntime",)  # imported when a model is loaded
+
+PROBE = """
+import json, sys
+import server
+print(json.dumps({"weights": str(server.MODEL_WEIGHTS), "imported": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES + LAZY_MODULES,)
+
+
+def main():
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(FASTAPI_ROOT), os.getenv("PYTHONPATH")])))
+    env.setdefault("API_KEY", "lean-imports")
+    for key in ("MODEL_WEIGHTS", "MODEL_PRECISION", "INFERENCE_WORKERS"):
+        env.pop(key, None)  # the default FP32 ONNX model in the server process
+    with tempfile.TemporaryDirectory() as cwd:
+        proc = subprocess.run([sys.executable, "-c", PROBE], cwd=cwd, env=env, capture_output=True, text=True)
+    assert proc.returncode == 0, f"import server failed:\n{proc.stderr}"
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    assert result["weights"].endswith(".onnx"), f"{result['weights']} is not an ONNX model"
+    assert not result["imported"], f"import server loaded {', '.join(result['imported'])}"
+    print(f"import server ({result['weights']}): none of {', '.join(HEAVY_MODULES + LAZY_MODULES)} imported")
+
+
+if __name__ == "__main__":
+    main()
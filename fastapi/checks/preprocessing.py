@@ -0,0 +1,60 @@
+"""
+Check that the NumPy preprocessing of the server is numerically identical to classify_transforms().
+
+Random images of varying size, including tiny and very wide or tall ones, are preprocessed by
+classify_transforms() of prediction/yolov5 (the reference, needs torch), by Preprocessor and by
+PrefetchLoader, which decodes PNG encoded images on its thread pool. Every element of the batches
+must be equal. Fails with an AssertionError (exit code 1) otherwise.
+
+Usage (from the fastapi directory):
+    $ python -m checks.preprocessing
+"""
+import cv2
+import numpy as np
+
+from image_loader import PrefetchLoader
+from onnx_classifier import Preprocessor
+
+
+def random_images(n=24, seed=0):
+    # BGR images between 40 and 400 pixels, plus the edge cases of 1 pixel and extreme aspect ratios
+    rng = np.random.default_rng(seed)
+    sizes = [tuple(rng.integers(40, 400, 2)) for _ in range(n)] + [(1, 1), (1, 300), (300, 1), (17, 1000)]
+    return [rng.integers(0, 256, (h, w, 3), dtype=np.uint8) for h, w in sizes]
+
+
+def check(imgsz):
+    import torch
+
+    from prediction.yolov5.classify.predict import classify_transforms  # sets up the imports of prediction/yolov5
+
+    ims = random_images()
+    transforms = classify_transforms(imgsz)
+    reference = torch.stack([transforms(im) for im in ims]).numpy()
+
+    preprocessor = Preprocessor((imgsz, imgsz), max_batch=8)  # grows for the full batch
+    batch = preprocessor(ims)
+    assert batch.shape == reference.shape, f"Preprocessor shape {batch.shape} != {reference.shape}"
+    assert np.array_equal(batch, reference), f"Preprocessor differs by {np.abs(batch - reference).max():.3g}"
+    batch = preprocessor(ims[:3])  # reused buffer
+    assert np.array_equal(batch, reference[:3]), "Preprocessor differs on a reused buffer"
+
+    encoded = [cv2.imencode(".png", im)[1].tobytes() for im in ims]  # lossless
+    loader = PrefetchLoader(threads=2, prefetch=2, batch_size=5)  # several batches in rotation
+    try:
+        batches = [batch.copy() for batch in loader(encoded, (imgsz, imgsz))]
+    finally:
+        loader.close()
+    assert [len(batch) for batch in batches] == [min(5, len(ims) - i) for i in range(0, len(ims), 5)]
+    batch = np.concatenate(batches)
+    assert np.array_equal(batch, reference), f"PrefetchLoader differs by {np.abs(batch - reference).max():.3g}"
+    print(f"{len(ims)} images at {imgsz}px: Preprocessor and PrefetchLoader identical to classify_transforms()")
+
+
+def main():
+    for imgsz in (128, 224):
+        check(imgsz)
+
+
+if __name__ == "__main__":
+    main()
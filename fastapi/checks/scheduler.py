@@ -0,0 +1,51 @@
+"""
+Check that the inference scheduler classifies the crops of concurrent requests in one forward pass.
+
+Two requests are submitted from two threads shortly after each other, within `max_wait_ms`, to a
+scheduler with a stub model that records the size of every batch. Both requests must be answered
+with their own probabilities from a single batch. Fails with an AssertionError (exit code 1) otherwise.
+
+Usage (from the fastapi directory):
+    $ python -m checks.scheduler
+"""
+import threading
+import time
+
+import numpy as np
+
+from inference_scheduler import InferenceScheduler
+
+
+def main(max_wait_ms=200):
+    batch_sizes = []
+
+    def classify(ims):
+        batch_sizes.append(len(ims))
+        return np.stack([np.full(2, im[0], np.float32) for im in ims])  # the crop's value as probabilities
+
+    scheduler = InferenceScheduler(None, max_batch_size=32, max_wait_ms=max_wait_ms, classify_fn=classify)
+    scheduler.start()
+    results = {}
+
+    def request(value, n):
+        results[value] = scheduler.classify([np.full(3, value, np.float32)] * n)
+
+    try:
+        threads = [threading.Thread(target=request, args=(1, 5))]
+        threads[0].start()
+        time.sleep(max_wait_ms / 1000 / 4)  # the second camera uploads while the first batch is collected
+        threads.append(threading.Thread(target=request, args=(2, 3)))
+        threads[1].start()
+        for thread in threads:
+            thread.join()
+    finally:
+        scheduler.stop()
+
+    assert batch_sizes == [8], f"2 concurrent requests were classified in batches of {batch_sizes}, expected [8]"
+    assert results[1].shape == (5, 2) and (results[1] == 1).all(), "probabilities of request 1 misrouted"
+    assert results[2].shape == (3, 2) and (results[2] == 2).all(), "probabilities of request 2 misrouted"
+    print(f"2 concurrent requests classified in one batch of {batch_sizes[0]} crops")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from log import LOGGER
+from onnx_classifier import OnnxClassifier, Preprocessor, decode
+
+DEFAULT_WEIGHTS = Path(__file__).parent / "prediction/yolov5/weights/efficientnet-b0_imgsz128.onnx"
+
+
+class TorchClassifier:
+    """Model of any other backend of prediction/yolov5 (i.e. PyTorch *.pt), with the interface of OnnxClassifier.
+
+    prediction/yolov5 and torch are only imported when such a model is loaded.
+    """
+
+    def __init__(self, weights, imgsz=(128, 128), **kwargs):
+        from prediction.yolov5.classify.predict import load_model
+
+        imgsz = (imgsz, imgsz) if isinstance(imgsz, int) else tuple(imgsz)
+        self.weights = Path(weights)
+        self.model = load_model(weights, imgsz=imgsz, **kwargs)
+        self.names = self.model.names
+        self.imgsz = imgsz
+        self._local = threading.local()
+
+    def preprocess(self, ims):
+        # Same preprocessing as OnnxClassifier, identical to classify_transforms()
+        preprocessor = getattr(self._local, "preprocessor", None)
+        if preprocessor is None:
+            preprocessor = self._local.preprocessor = Preprocessor(self.imgsz)
+        return preprocessor(ims)
+
+    def classify(self, ims, max_batch=32):
+        import torch
+
+        from prediction.yolov5.classify.predict import classify_images
+
+        return classify_images(self.model, [torch.from_numpy(np.asarray(im)) for im in ims], max_batch).numpy()
+
+
+def load_classifier(weights, imgsz=(128, 128), session_options=None, **kwargs):
+    # OnnxClassifier for *.onnx weights, otherwise TorchClassifier. Loader of ModelRegistry
+    if Path(weights).suffix == ".onnx" and not kwargs.get("dnn"):
+        return OnnxClassifier(weights, imgsz=imgsz, session_options=session_options)
+    return TorchClassifier(weights, imgsz=imgsz, session_options=session_options, **kwargs)
+
+
+def aggregate_predictions(pred, names, topk=5):
+    # Aggregate per image probabilities (N, classes) of one tracking run into one result per run,
+    # also used by prediction/yolov5/classify/predict.py
+    mean = pred.mean(0)  # mean probability per class
+    topki = np.argsort(-mean, kind="stable")[:topk].tolist()
+    votes = np.bincount(pred.argmax(1), minlength=pred.shape[1])  # top1 votes per class
+    vote = int(votes.argmax())  # ties are resolved in favor of the lower class index
+    return {
+        "top1": names[topki[0]],
+        "top1_prob": round(float(mean[topki[0]]), 2),
+        "vote_top1": names[vote],
+        "vote_share": round(float(votes[vote]) / len(pred), 2),
+        "topk": [{"class": names[j], "prob": round(float(mean[j]), 2)} for j in topki],
+        "n_images": len(pred),
+    }
+
+
+def classify_run(model, images, scheduler=None, max_batch=32, topk=5, loader=None):
+    # Classify the in-memory images [(name, bytes), ...] of one tracking run and aggregate the result.
+    # With a scheduler, the forward pass is batched together with the images of concurrent runs.
+    # With a PrefetchLoader, the images are decoded on its threads while the previous batch is classified.
+    assert images, "No images found"
+    t0 = time.perf_counter()
+    sources = [content for _, content in images]
+    batches = loader(sources, model.imgsz) if loader else [model.preprocess([decode(c) for c in sources])]
+    pred, inference_s = [], 0.0
+    for batch in batches:
+        t = time.perf_counter()
+        pred.append(scheduler.classify(list(batch)) if scheduler else model.classify(batch, max_batch))
+        inference_s += time.perf_counter() - t
+    pred = np.concatenate(pred)
+    t1 = time.perf_counter()
+    results = aggregate_predictions(pred, model.names, topk=topk)
+    t2 = time.perf_counter()
+
+    seen = len(pred)
+    LOGGER.info(
+        f"in-memory images: {seen} images, top1 {results['top1']} {results['top1_prob']:.2f}, "
+        f"vote {results['vote_top1']} {results['vote_share']:.2f}"
+    )
+    LOGGER.info(
+        f"Speed: {(t1 - t0 - inference_s) / seen * 1e3:.1f}ms load + pre-process, "
+        f"{inference_s / seen * 1e3:.1f}ms inference, "
+        f"{(t2 - t1) / seen * 1e3:.1f}ms post-process per image at shape {(1, 3, *model.imgsz)}"
+    )
+    return results
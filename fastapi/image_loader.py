@@ -0,0 +1,78 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+from onnx_classifier import decode, normalize, resize_into
+
+
+def read(source):
+    # Encoded image bytes or an image path to a BGR HWC uint8 array
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return decode(source)
+    im = cv2.imread(str(source))
+    if im is None:
+        raise ValueError(f"Image {source} could not be read")
+    return im
+
+
+class PrefetchLoader:
+    """Decodes and resizes images on a bounded thread pool, ahead of inference.
+
+    Iterating over `loader(sources, imgsz)` yields the images (encoded bytes or paths)
+    as normalized NCHW float32 batches of at most `batch_size` images, in order and
+    identical to Preprocessor. The images of a batch are decoded and resized by up to
+    `threads` threads at once (cv2 releases the GIL), and while the caller classifies
+    one batch, the next `prefetch` batches are already being decoded, so decoding
+    overlaps with inference instead of alternating with it.
+
+    The batches are written into up to `prefetch` + 1 buffers, used in rotation: a
+    yielded batch is valid until the next one is requested. The buffers are sized to
+    the images of the call and are freed after it, so idle callers hold no memory.
+    The thread pool is shared by all callers.
+    """
+
+    def __init__(self, threads=2, prefetch=2, batch_size=32):
+        self.threads = threads
+        self.prefetch = prefetch
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="decode")
+        self._local = threading.local()  # resize buffer per decode thread
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+    def _load(self, source, out):
+        # Runs on a decode thread, fills one slot of a batch
+        resized = getattr(self._local, "resized", None)
+        if resized is None or resized.shape[:2] != out.shape[1:]:
+            resized = self._local.resized = np.empty((*out.shape[1:], 3), np.uint8)
+        resize_into(read(source), out, resized)
+
+    def __call__(self, sources, imgsz=(128, 128)):
+        chunks = [sources[i : i + self.batch_size] for i in range(0, len(sources), self.batch_size)]
+        # One buffer per batch in flight, as large as the largest batch of this call
+        shape = (min(len(sources), self.batch_size), 3, *imgsz)
+        buffers = [np.empty(shape, np.float32) for _ in range(min(self.prefetch + 1, len(chunks)))]
+        submitted = []  # (batch, futures of its images) per chunk, in order
+
+        def submit(k):
+            batch = buffers[k % len(buffers)][: len(chunks[k])]
+            futures = [self._executor.submit(self._load, source, out) for source, out in zip(chunks[k], batch)]
+            submitted.append((batch, futures))
+
+        try:
+            for k in range(min(self.prefetch, len(chunks))):
+                submit(k)
+            for k in range(len(chunks)):
+                # The buffer of batch k - 1 is free again once the caller asks for batch k
+                if k + self.prefetch < len(chunks):
+                    submit(k + self.prefetch)
+                batch, futures = submitted[k]
+                for future in futures:
+                    future.result()  # raises if an image could not be decoded
+                yield normalize(batch)
+        finally:
+            # On an error or an abandoned iteration, no decode thread may still write into the buffers
+            wait([future for _, futures in submitted for future in futures if not future.cancel()])
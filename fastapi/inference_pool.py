@@ -0,0 +1,211 @@
+import copy
+import multiprocessing
+import os
+import queue
+import threading
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+
+import numpy as np
+
+from log import LOGGER
+from onnx_session import SessionProfile
+
+
+class _Worker:
+    # Parent side of one worker process: its pipe and the shared memory for one batch in and out
+    def __init__(self, context, index, weights, max_batch, input_shape, num_classes, threads, session_profile):
+        self.index = index
+        self.input_shm = SharedMemory(create=True, size=max_batch * int(np.prod(input_shape)) * 4)
+        self.output_shm = SharedMemory(create=True, size=max_batch * num_classes * 4)
+        self.input = np.ndarray((max_batch, *input_shape), np.float32, buffer=self.input_shm.buf)
+        self.output = np.ndarray((max_batch, num_classes), np.float32, buffer=self.output_shm.buf)
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(
+                str(weights),
+                max_batch,
+                input_shape,
+                num_classes,
+                self.input_shm.name,
+                self.output_shm.name,
+                child_conn,
+                threads,
+                session_profile,
+            ),
+            name=f"inference-worker-{index}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def close(self):
+        if self.process.is_alive():
+            try:
+                self.conn.send(None)
+                self.process.join(timeout=10)
+            except OSError:  # the pipe broke, i.e. the process is exiting
+                pass
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+        del self.input, self.output  # release the buffers before closing the shared memory
+        for shm in (self.input_shm, self.output_shm):
+            shm.close()
+            shm.unlink()
+
+
+class InferencePool:
+    """Classification on a pool of worker processes, one batch per process at a time.
+
+    Every worker process loads its own copy of the model, for ONNX models with an
+    onnxruntime session of `session_profile` limited to `threads` intra-op threads
+    (default: the CPU cores divided by the number of workers), so inference of
+    concurrent batches is not serialized by the GIL. Batches are copied into
+    shared memory, only the batch size is sent to the worker and the
+    probabilities are read back from shared memory as well. A worker process that
+    dies is replaced by a new one in the background, the batch it had fails.
+    """
+
+    def __init__(
+        self, weights, workers=2, max_batch=32, imgsz=128, num_classes=None, threads=None, session_profile=None
+    ):
+        self.weights = weights
+        self.workers = workers
+        self.max_batch = max_batch
+        self.input_shape = (3, imgsz, imgsz)
+        self.num_classes = num_classes
+        self.threads = threads or max((os.cpu_count() or 1) // workers, 1)
+        self.session_profile = session_profile or SessionProfile()
+        self._idle = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()  # guards _workers and _stopped against replacements of dead workers
+        self._stopped = False
+
+    def start(self):
+        self._stopped = False
+        self._workers = [self._spawn(i) for i in range(self.workers)]
+        for worker in self._workers:
+            try:
+                self._wait_ready(worker)
+            except RuntimeError:
+                self.stop()
+                raise
+            self._idle.put(worker)
+        LOGGER.info(f"Started {self.workers} inference workers with {self.threads} threads each")
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.close()
+        self._idle = queue.Queue()
+
+    def _spawn(self, index):
+        # Spawned instead of forked: the parent has onnxruntime thread pools already
+        return _Worker(
+            multiprocessing.get_context("spawn"),
+            index,
+            self.weights,
+            self.max_batch,
+            self.input_shape,
+            self.num_classes,
+            self.threads,
+            self.session_profile,
+        )
+
+    @staticmethod
+    def _wait_ready(worker):
+        try:
+            status, message = worker.conn.recv()  # wait until the model is loaded
+        except (EOFError, OSError) as e:
+            status, message = "error", repr(e)
+        if status != "ready":
+            raise RuntimeError(f"Inference worker failed to start: {message}")
+
+    def _replace(self, worker):
+        # Runs on a thread: close a worker whose process died and start a new one in its place
+        with self._lock:
+            if worker not in self._workers:
+                return  # the pool was stopped meanwhile, stop() closes the worker
+            self._workers.remove(worker)
+        worker.close()
+        try:
+            new_worker = self._spawn(worker.index)
+            self._wait_ready(new_worker)
+        except Exception:
+            LOGGER.exception(f"Inference worker {worker.index} could not be restarted, dropped from the pool")
+            return
+        with self._lock:
+            if not self._stopped:
+                self._workers.append(new_worker)
+                self._idle.put(new_worker)
+                LOGGER.info(f"Restarted inference worker {worker.index}")
+                return
+        new_worker.close()
+
+    def classify(self, ims):
+        # Probabilities (N, classes) for a list of CHW arrays, in batches of at most max_batch images
+        probs = []
+        for i in range(0, len(ims), self.max_batch):
+            probs.append(self._classify_batch(ims[i : i + self.max_batch]))
+        return np.concatenate(probs)
+
+    def _classify_batch(self, ims):
+        worker = self._idle.get()
+        try:
+            for i, im in enumerate(ims):
+                worker.input[i] = im
+            worker.conn.send(len(ims))
+            status, message = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            # The worker process died, it doesn't go back to the idle workers
+            LOGGER.error(f"Inference worker {worker.index} died: {e!r}, restarting it")
+            threading.Thread(target=self._replace, args=(worker,), name="inference-worker-restart", daemon=True).start()
+            raise RuntimeError(f"Inference worker {worker.index} died") from e
+        probs = worker.output[: len(ims)].copy() if status == "ok" else None
+        self._idle.put(worker)
+        if status != "ok":
+            raise RuntimeError(f"Inference worker failed: {message}")
+        return probs
+
+
+def _worker_main(weights, max_batch, input_shape, num_classes, input_name, output_name, conn, threads, session_profile):
+    # Entry point of a worker process: load the model, then classify the batches in shared memory until None
+    if Path(weights).suffix != ".onnx":
+        import torch
+
+        torch.set_num_threads(threads)
+    input_shm = SharedMemory(name=input_name)
+    output_shm = SharedMemory(name=output_name)
+    inputs = np.ndarray((max_batch, *input_shape), np.float32, buffer=input_shm.buf)
+    outputs = np.ndarray((max_batch, num_classes), np.float32, buffer=output_shm.buf)
+
+    try:
+        try:
+            from model_registry import ModelRegistry
+
+            session_profile = copy.copy(session_profile)
+            session_profile.intra_op_threads = threads
+            session_profile.inter_op_threads = 1
+            # Reloads the model in this process when the weights file changes
+            registry = ModelRegistry(loader=session_profile.load)
+            model_kwargs = {"imgsz": input_shape[1:]}
+            registry.load(weights, **model_kwargs)
+        except Exception as e:
+            conn.send(("error", repr(e)))
+            return
+        conn.send(("ready", None))
+
+        while (n := conn.recv()) is not None:
+            try:
+                outputs[:n] = registry.get(weights, **model_kwargs).classify(inputs[:n], max_batch)
+                conn.send(("ok", None))
+            except Exception as e:
+                conn.send(("error", repr(e)))
+    finally:
+        del inputs, outputs  # release the buffers before closing the shared memory
+        input_shm.close()
+        output_shm.close()
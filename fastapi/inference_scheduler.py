@@ -0,0 +1,156 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from log import LOGGER
+
+
+class _Request:
+    # Crops of one request waiting for their class probabilities
+    def __init__(self, ims):
+        self.ims = ims
+        self.probs = [None] * len(ims)
+        self.remaining = len(ims)
+        self.enqueued = time.monotonic()
+        self.future = Future()
+
+
+class InferenceScheduler:
+    """Dynamic micro-batching of classification requests.
+
+    Crops submitted by concurrent requests are queued and coalesced into batches of
+    up to `max_batch_size` images. A batch is flushed as soon as it is full or when
+    its oldest crop has waited `max_wait_ms`, then classified in one forward pass on
+    the model returned by `model_fn` (an OnnxClassifier or TorchClassifier) and the
+    probabilities are routed back to the submitting requests.
+
+    With a `classify_fn` (list of CHW arrays -> probabilities), i.e. the `classify`
+    method of an InferencePool, batches are classified by it instead and `workers`
+    batches are in flight at the same time. After `stop`, `submit` raises
+    RuntimeError and crops that were still queued fail with it.
+    """
+
+    def __init__(self, model_fn, max_batch_size=32, max_wait_ms=10, classify_fn=None, workers=1):
+        self.model_fn = model_fn
+        self.classify_fn = classify_fn or (lambda ims: self.model_fn().classify(ims, self.max_batch_size))
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.workers = workers
+        self._queue = queue.Queue()  # (request, crop index) or None to stop
+        self._threads = []
+        self._stopped = False
+        self._lock = threading.Lock()  # guards the metrics, the results of requests and _stopped
+        self._batches = 0
+        self._crops = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._last_batch_size = 0
+
+    def start(self):
+        self._stopped = False
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, name=f"inference-scheduler-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+        for _ in self._threads:
+            self._queue.put(None)  # one per thread
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        # Fail the requests of crops behind the stop markers, nothing would resolve their futures
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and not item[0].future.done():
+                item[0].future.set_exception(RuntimeError("Inference scheduler stopped"))
+
+    def submit(self, ims):
+        # Queue a list of CHW arrays, the returned future resolves to their probabilities (N, classes)
+        request = _Request(ims)
+        if not ims:
+            request.future.set_result(np.empty((0, 0), np.float32))
+            return request.future
+        with self._lock:  # crops are queued before stop() drains the queue, or not at all
+            if self._stopped:
+                raise RuntimeError("Inference scheduler stopped")
+            for i in range(len(ims)):
+                self._queue.put((request, i))
+        return request.future
+
+    def classify(self, ims):
+        return self.submit(ims).result()
+
+    def metrics(self):
+        with self._lock:
+            batches = self._batches
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": batches,
+                "crops": self._crops,
+                "last_batch_size": self._last_batch_size,
+                "mean_batch_size": self._crops / batches if batches else 0.0,
+                "mean_batch_fill_ratio": self._crops / (batches * self.max_batch_size) if batches else 0.0,
+                "mean_wait_ms": self._wait_total / self._crops * 1000 if self._crops else 0.0,
+                "max_wait_ms_observed": self._wait_max * 1000,
+            }
+
+    def _next_batch(self):
+        # Block for the first crop, then collect more until the batch is full or the deadline passes
+        item = self._queue.get()
+        if item is None:
+            return None, True
+        batch = [item]
+        deadline = item[0].enqueued + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _worker(self):
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if batch:
+                self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        start = time.monotonic()
+        waits = [start - request.enqueued for request, _ in batch]
+        with self._lock:
+            self._batches += 1
+            self._crops += len(batch)
+            self._wait_total += sum(waits)
+            self._wait_max = max(self._wait_max, *waits)
+            self._last_batch_size = len(batch)
+
+        try:
+            probs = self.classify_fn([request.ims[i] for request, i in batch])
+        except Exception as e:
+            LOGGER.exception("Batched inference failed")
+            for request, _ in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        with self._lock:  # crops of one request can be in batches of several threads
+            for (request, i), prob in zip(batch, probs):
+                request.probs[i] = prob
+                request.remaining -= 1
+                if request.remaining == 0 and not request.future.done():
+                    request.future.set_result(np.stack(request.probs))
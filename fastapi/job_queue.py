@@ -0,0 +1,169 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from log import LOGGER
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created_at ON jobs (status, created_at);
+"""
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """Persistent FIFO queue of jobs, processed by a pool of worker threads.
+
+    Jobs are stored in an SQLite database, so queued jobs survive a restart: jobs
+    that were running when the process stopped are queued again on `start`. Each
+    job's JSON payload is passed to `handler`, whose return value is stored as the
+    result of the job. `submit` raises QueueFull when `max_pending` jobs are
+    queued or running. Finished jobs are deleted after `retention_s` seconds.
+    """
+
+    def __init__(self, path, handler, workers=2, max_pending=100, retention_s=7 * 24 * 3600):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retention_s = retention_s
+        self._local = threading.local()
+        self._claim_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stop = False
+        self._threads = []
+        with self._connection() as con:
+            con.executescript(SCHEMA)
+
+    def _connection(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=30)
+            con.row_factory = sqlite3.Row
+            con.execute("PRAGMA journal_mode=WAL")
+            self._local.con = con
+        return con
+
+    def start(self):
+        with self._connection() as con:
+            # Jobs interrupted by a restart are processed again
+            con.execute("UPDATE jobs SET status = ?, started_at = NULL WHERE status = ?", (QUEUED, RUNNING))
+            con.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (DONE, FAILED, time.time() - self.retention_s),
+            )
+        self._stop = False
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        # Running jobs are finished, queued jobs stay in the database
+        with self._wakeup:
+            self._stop = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, payload):
+        job_id = uuid.uuid4().hex
+        with self._claim_lock, self._connection() as con:
+            if self.full():
+                raise QueueFull(f"{self.max_pending} jobs are pending already")
+            con.execute(
+                "INSERT INTO jobs (id, status, payload, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(payload), time.time()),
+            )
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def full(self):
+        return self._count(self._connection(), QUEUED, RUNNING) >= self.max_pending
+
+    def get(self, job_id):
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {key: row[key] for key in ("id", "status", "error", "created_at", "started_at", "finished_at")}
+        job["result"] = json.loads(row["result"]) if row["result"] is not None else None
+        if row["status"] == QUEUED:
+            # Number of jobs that are processed before this one
+            job["position"] = self._connection().execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?", (QUEUED, row["created_at"])
+            ).fetchone()[0]
+        return job
+
+    def metrics(self):
+        con = self._connection()
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "queued": self._count(con, QUEUED),
+            "running": self._count(con, RUNNING),
+            "done": self._count(con, DONE),
+            "failed": self._count(con, FAILED),
+        }
+
+    @staticmethod
+    def _count(con, *statuses):
+        sql = f"SELECT COUNT(*) FROM jobs WHERE status IN ({', '.join('?' * len(statuses))})"
+        return con.execute(sql, statuses).fetchone()[0]
+
+    def _claim(self):
+        # Mark the oldest queued job as running, returns (id, payload) or None
+        with self._claim_lock, self._connection() as con:
+            row = con.execute(
+                "SELECT id, payload FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            con.execute("UPDATE jobs SET status = ?, started_at = ? WHERE id = ?", (RUNNING, time.time(), row["id"]))
+        return row["id"], json.loads(row["payload"])
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._connection() as con:
+            con.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+            )
+
+    def _worker(self):
+        while True:
+            with self._wakeup:
+                if self._stop:
+                    return
+            job = self._claim()
+            if job is None:
+                with self._wakeup:
+                    if not self._stop:
+                        self._wakeup.wait(timeout=1)
+                continue
+            job_id, payload = job
+            try:
+                result = self.handler(payload)
+            except Exception as e:
+                LOGGER.exception(f"Job {job_id} failed")
+                self._finish(job_id, FAILED, error=str(e))
+            else:
+                self._finish(job_id, DONE, result=result)
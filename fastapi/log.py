@@ -0,0 +1,11 @@
+import logging
+
+# The logger of prediction/yolov5 (utils.general.LOGGER), set up the same way without importing it and its torch
+# dependencies. utils.general configures it again when a PyTorch model is loaded.
+LOGGER = logging.getLogger("yolov5")
+if not LOGGER.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    LOGGER.addHandler(_handler)
+    LOGGER.setLevel(logging.INFO)
+    LOGGER.propagate = False
@@ -0,0 +1,64 @@
+import os
+import threading
+from pathlib import Path
+
+from classification import load_classifier
+from log import LOGGER
+
+
+class ModelRegistry:
+    """Process-wide cache of loaded and warmed up classification models.
+
+    Models are keyed by their weights path. Every lookup compares the modification
+    time of the weights file with the one seen at load time and transparently
+    reloads the model if the file on disk has been replaced. Models are loaded with
+    `loader`, called with the weights path and the keyword arguments of the lookup.
+    """
+
+    def __init__(self, loader=load_classifier):
+        self.loader = loader
+        self._models = {}  # weights path -> (mtime, model)
+        self._lock = threading.Lock()
+
+    def load(self, weights, **kwargs):
+        weights = str(Path(weights))
+        with self._lock:
+            return self._load(weights, **kwargs)
+
+    def get(self, weights, **kwargs):
+        weights = str(Path(weights))
+        entry = self._models.get(weights)
+        if entry is not None and entry[0] == self._mtime(weights):
+            return entry[1]
+        with self._lock:
+            entry = self._models.get(weights)  # another thread may have reloaded already
+            if entry is not None and entry[0] == self._mtime(weights):
+                return entry[1]
+            try:
+                return self._load(weights, **kwargs)
+            except Exception:
+                if entry is None:
+                    raise
+                # Keep serving the old model, e.g. while the new file is still being copied
+                LOGGER.exception(f"Reloading {weights} failed, keeping previously loaded model")
+                return entry[1]
+
+    def unload(self, weights):
+        with self._lock:
+            self._models.pop(str(Path(weights)), None)
+
+    def _load(self, weights, **kwargs):
+        mtime = self._mtime(weights)
+        action = "Reloading" if weights in self._models else "Loading"
+        LOGGER.info(f"{action} classification model {weights}")
+        model = self.loader(weights, **kwargs)
+        self._models[weights] = (mtime, model)
+        return model
+
+    @staticmethod
+    def _mtime(weights):
+        try:
+            return os.stat(weights).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
@@ -0,0 +1,150 @@
+import ast
+import threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from log import LOGGER
+
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], np.float32)[:, None, None]  # RGB, CHW broadcastable
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], np.float32)[:, None, None]
+
+
+def decode(content):
+    # Encoded image bytes to a BGR HWC uint8 array
+    im = cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_COLOR)
+    if im is None:
+        raise ValueError("Image could not be decoded")
+    return im
+
+
+def resize_into(im, out, resized):
+    # Resize a BGR HWC uint8 image into the resized buffer (H, W, 3) and copy it into its CHW RGB float32 batch slot
+    cv2.resize(im, resized.shape[1::-1], dst=resized, interpolation=cv2.INTER_LINEAR)
+    np.copyto(out, resized.transpose(2, 0, 1)[::-1])  # HWC to CHW, BGR to RGB, uint8 to float32
+
+
+def normalize(batch):
+    # Scale and normalize a float32 NCHW batch of 0-255 RGB values in place
+    batch /= 255.0  # 0-255 to 0.0-1.0
+    batch -= IMAGENET_MEAN
+    batch /= IMAGENET_STD
+    return batch
+
+
+class Preprocessor:
+    """Decoded BGR images to one normalized RGB NCHW float32 batch.
+
+    Does the same as classify_transforms() of prediction/yolov5 (cv2 resize, BGR to
+    RGB, scale to 0-1, normalize with the ImageNet mean and std) with identical
+    results, but for a whole batch at once: every image is resized into one reused
+    uint8 buffer and copied into its slot of a preallocated float32 batch, which is
+    then normalized in place. Nothing is allocated per image, the batch buffer only
+    grows when a larger batch comes in. Not thread-safe, the returned batch is a
+    view of the buffer and valid until the next call.
+    """
+
+    def __init__(self, imgsz=(128, 128), max_batch=32):
+        self.imgsz = imgsz
+        self._resized = np.empty((*imgsz, 3), np.uint8)
+        self._batch = np.empty((max_batch, 3, *imgsz), np.float32)
+
+    def __call__(self, ims):
+        if len(ims) > len(self._batch):
+            self._batch = np.empty((len(ims), 3, *self.imgsz), np.float32)
+        batch = self._batch[: len(ims)]
+        for im, out in zip(ims, batch):
+            resize_into(im, out, self._resized)
+        return normalize(batch)
+
+
+def input_size(shape, imgsz=(128, 128)):
+    # Batch size (None if dynamic) and (h, w) of an NCHW model input shape, imgsz where the size is dynamic
+    batch, _, h, w = shape
+    imgsz = (imgsz, imgsz) if isinstance(imgsz, int) else tuple(imgsz)
+    return batch if isinstance(batch, int) else None, (h, w) if isinstance(h, int) and isinstance(w, int) else imgsz
+
+
+def class_names(meta):
+    # Class names {index: name} of the model metadata written by export.py
+    return ast.literal_eval(meta["names"]) if "names" in meta else {i: f"class{i}" for i in range(1000)}
+
+
+def softmax(x):
+    x = np.exp(x - x.max(1, keepdims=True))
+    return x / x.sum(1, keepdims=True)
+
+
+class OnnxClassifier:
+    """Classification model in ONNX format, run by onnxruntime on the CPU.
+
+    Does the same as DetectMultiBackend and classify_images() of prediction/yolov5
+    for ONNX models, but with NumPy only, so serving an ONNX model does not import
+    torch. The class names are read from the model metadata written by export.py.
+    """
+
+    def __init__(self, weights, imgsz=(128, 128), session_options=None):
+        import onnxruntime  # imported on load, the module is imported at server start
+
+        self.weights = Path(weights)
+        LOGGER.info(f"Loading {self.weights} for ONNX Runtime inference...")
+        self.session = onnxruntime.InferenceSession(
+            str(self.weights), sess_options=session_options, providers=["CPUExecutionProvider"]
+        )
+        inputs = self.session.get_inputs()[0]
+        self.input_name = inputs.name
+        self.dtype = np.float16 if inputs.type == "tensor(float16)" else np.float32
+        self.batch_size, self.imgsz = input_size(inputs.shape, imgsz)  # batch size None if dynamic
+        self.names = class_names(self.session.get_modelmeta().custom_metadata_map)
+        self._local = threading.local()  # Preprocessor per thread
+
+        # Warmup, onnxruntime allocates its buffers on the first run
+        self.predict(np.zeros((self.batch_size or 1, 3, *self.imgsz), np.float32))
+
+    def preprocess(self, ims):
+        # Decoded BGR images to a model input NCHW batch, a view valid until the next call of this thread
+        preprocessor = getattr(self._local, "preprocessor", None)
+        if preprocessor is None:
+            preprocessor = self._local.preprocessor = Preprocessor(self.imgsz)
+        return preprocessor(ims)
+
+    def predict(self, batch):
+        # Class probabilities (N, classes) of one BCHW batch
+        y = self.session.run(None, {self.input_name: batch.astype(self.dtype, copy=False)})[0]
+        return softmax(y.astype(np.float32))
+
+    def classify(self, ims, max_batch=32):
+        # Class probabilities (N, classes) of a list of CHW images or an NCHW array, in chunks of at most max_batch
+        if self.batch_size is not None:
+            max_batch = self.batch_size if self.batch_size == 1 else min(max_batch, self.batch_size)
+        probs = []
+        for i in range(0, len(ims), max_batch):
+            batch = ims[i : i + max_batch] if isinstance(ims, np.ndarray) else np.stack(ims[i : i + max_batch])
+            n = len(batch)
+            if self.batch_size is not None and n < self.batch_size:  # pad static batch models
+                batch = np.concatenate((batch, np.zeros((self.batch_size - n, *batch.shape[1:]), batch.dtype)))
+            probs.append(self.predict(batch)[:n])
+        return np.concatenate(probs)
+
+
+class OnnxModelInfo:
+    """Class names and input size of an ONNX model, read from the file without an inference session.
+
+    Stands in for OnnxClassifier where a process only preprocesses images and aggregates
+    probabilities, i.e. the server when inference runs in an InferencePool, so the weights
+    are not held in memory there as well.
+    """
+
+    def __init__(self, weights, imgsz=(128, 128), **kwargs):
+        import onnx
+
+        self.weights = Path(weights)
+        model = onnx.load(str(self.weights), load_external_data=False)
+        dims = model.graph.input[0].type.tensor_type.shape.dim
+        shape = [d.dim_value if d.HasField("dim_value") else d.dim_param for d in dims]
+        self.batch_size, self.imgsz = input_size(shape, imgsz)
+        self.names = class_names({meta.key: meta.value for meta in model.metadata_props})
+        self._local = threading.local()
+
+    preprocess = OnnxClassifier.preprocess
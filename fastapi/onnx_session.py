@@ -0,0 +1,124 @@
+import hashlib
+import os
+import platform
+import uuid
+from pathlib import Path
+
+from classification import load_classifier
+from log import LOGGER
+
+# Names of the onnxruntime.ExecutionMode and onnxruntime.GraphOptimizationLevel members, onnxruntime is imported
+# when a session is configured, so the server process of a worker pool doesn't import it
+EXECUTION_MODES = {"sequential": "ORT_SEQUENTIAL", "parallel": "ORT_PARALLEL"}
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+
+class SessionProfile:
+    """Settings of the ONNX Runtime sessions used for CPU inference.
+
+    Thread counts of 0 leave the choice to ONNX Runtime (one intra-op thread per
+    core). With a `cache_dir`, the graph optimized by ONNX Runtime is saved there
+    when a model is loaded for the first time and later loads read the optimized
+    graph instead, skipping the optimization. A cached graph is only used for the
+    same weights file, ONNX Runtime version, optimization level and CPU
+    architecture. The layout optimizations of level "all" (i.e. NCHWc for AVX2 or
+    AVX-512) depend on the CPU features of the host, so the graph is saved at level
+    "extended" and those are applied again whenever the cached graph is loaded: a
+    cache on a volume moved to another host never holds a graph for the wrong CPU.
+    """
+
+    def __init__(
+        self,
+        intra_op_threads=0,
+        inter_op_threads=0,
+        execution_mode="sequential",
+        graph_optimization="all",
+        cache_dir=None,
+    ):
+        if execution_mode not in EXECUTION_MODES:
+            raise ValueError(f"Unknown execution mode {execution_mode!r}, expected one of {list(EXECUTION_MODES)}")
+        if graph_optimization not in GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(
+                f"Unknown graph optimization level {graph_optimization!r}, "
+                f"expected one of {list(GRAPH_OPTIMIZATION_LEVELS)}"
+            )
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.execution_mode = execution_mode
+        self.graph_optimization = graph_optimization
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+
+    @property
+    def cached_optimization(self):
+        # Optimization level of the saved graph, without the hardware specific optimizations of level "all"
+        return "extended" if self.graph_optimization == "all" else self.graph_optimization
+
+    def session_options(self, optimize=True, optimized_model_path=None):
+        # optimize=False for graphs loaded from the cache, only the optimizations that were not saved are applied.
+        # With an optimized_model_path, the graph is optimized up to the cached level and saved there
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        options.execution_mode = getattr(onnxruntime.ExecutionMode, EXECUTION_MODES[self.execution_mode])
+        if optimized_model_path is not None:
+            level = self.cached_optimization
+            options.optimized_model_filepath = str(optimized_model_path)
+        elif optimize:
+            level = self.graph_optimization
+        else:
+            level = "all" if self.graph_optimization == "all" else "disable"
+        options.graph_optimization_level = getattr(onnxruntime.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[level])
+        return options
+
+    def cache_path(self, weights):
+        # Path of the optimized graph of an ONNX weights file, None if it is not cached
+        import onnxruntime
+
+        if self.cache_dir is None or self.graph_optimization == "disable" or Path(weights).suffix != ".onnx":
+            return None
+        stat = os.stat(weights)
+        key = ":".join(
+            str(part)
+            for part in (
+                Path(weights).resolve(),
+                stat.st_size,
+                stat.st_mtime_ns,
+                onnxruntime.__version__,
+                self.cached_optimization,
+                platform.machine(),
+            )
+        )
+        return Path(self.cache_dir, f"{Path(weights).stem}-{hashlib.sha1(key.encode()).hexdigest()[:16]}.onnx")
+
+    def load(self, weights, **kwargs):
+        # load_classifier() with sessions of this profile, drop-in loader for ModelRegistry
+        if Path(weights).suffix != ".onnx":
+            return load_classifier(weights, **kwargs)
+        path = self.cache_path(weights)
+        if path is None:
+            return load_classifier(weights, session_options=self.session_options(), **kwargs)
+        if path.is_file():
+            LOGGER.info(f"Using optimized graph {path} of {weights}")
+            return load_classifier(path, session_options=self.session_options(optimize=False), **kwargs)
+
+        import onnxruntime
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{uuid.uuid4().hex}.{path.name}")  # ONNX Runtime picks the format by suffix
+        # This session only optimizes and saves the graph, the model is loaded from the saved graph
+        options = self.session_options(optimized_model_path=tmp_path)
+        onnxruntime.InferenceSession(str(weights), sess_options=options, providers=["CPUExecutionProvider"])
+        if not tmp_path.is_file():
+            return load_classifier(weights, session_options=self.session_options(), **kwargs)
+        os.replace(tmp_path, path)
+        for stale in path.parent.glob(f"{Path(weights).stem}-*.onnx"):
+            if stale != path:  # graphs of previous weights files or settings
+                stale.unlink(missing_ok=True)
+        return load_classifier(path, session_options=self.session_options(optimize=False), **kwargs)
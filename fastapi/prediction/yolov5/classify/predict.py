@@ -55,6 +55,12 @@ Modifications:
 - create new .csv file with classification results and timestamp + tracking ID
   extracted from image filename, save to 'results/{name}_data_classified.csv' (if new-csv)
 - print script run time
+- add load_model() to load + warm up a model once, run() reuses a preloaded model if passed
+- accept in-memory images [(name, bytes), ...] as source, decoded without a round trip to disk
+- classify all images of a tracking run in batches (classify_images()) and return one
+  aggregated result per run (aggregate_predictions() of fastapi/classification.py): mean
+  probability top1, majority vote, top-k
+- pass onnxruntime.SessionOptions from load_model() to DetectMultiBackend (session_options)
 """
 
 import argparse
@@ -64,7 +70,6 @@ import sys
 import time
 from pathlib import Path
 
-import matplotlib.pyplot as plt
 import pandas as pd
 import torch
 import torch.nn.functional as F
@@ -74,13 +79,13 @@ ROOT = FILE.parents[1]  # prediction directory -> START HERE
 SERVER_ROOT = FILE.parents[3]
 if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))  # add ROOT to PATH
+if str(SERVER_ROOT) not in sys.path:
+    sys.path.append(str(SERVER_ROOT))  # add SERVER_ROOT to PATH, for classification.py
 ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
-from ultralytics.utils.plotting import Annotator
-
 from models.common import DetectMultiBackend
 from utils.augmentations import classify_transforms
-from utils.dataloaders import IMG_FORMATS, VID_FORMATS, LoadImages, LoadScreenshots, LoadStreams
+from utils.dataloaders import IMG_FORMATS, VID_FORMATS, LoadImageBytes, LoadImages, LoadScreenshots, LoadStreams
 from utils.general import (
     LOGGER,
     Profile,
@@ -88,7 +93,6 @@ from utils.general import (
     check_img_size,
     check_imshow,
     check_requirements,
-    colorstr,
     cv2,
     increment_path,
     print_args,
@@ -96,13 +100,39 @@ from utils.general import (
 )
 from utils.torch_utils import select_device, smart_inference_mode
 
+from classification import aggregate_predictions
+
 # Set start time for script execution timer
 start_time = time.monotonic()
 
+DEFAULT_WEIGHTS = ROOT / "weights/efficientnet-b0_imgsz128.onnx"
+
+
+@smart_inference_mode()
+def load_model(
+    weights=DEFAULT_WEIGHTS,  # model.pt path(s)
+    data=ROOT / "data/coco128.yaml",  # dataset.yaml path
+    imgsz=(128, 128),  # inference size (height, width)
+    device="cpu",  # cuda device, i.e. 0 or 0,1,2,3 or cpu
+    half=False,  # use FP16 half-precision inference
+    dnn=False,  # use OpenCV DNN for ONNX inference
+    session_options=None,  # onnxruntime.SessionOptions for ONNX Runtime inference
+):
+    # Load model and run one forward pass, so the first request does not pay for session setup
+    device = select_device(device)
+    model = DetectMultiBackend(weights, device=device, dnn=dnn, data=data, fp16=half, session_options=session_options)
+    imgsz = check_img_size(imgsz, s=model.stride)  # check image size
+    bs = max_batch_size(model) or 1  # batch_size
+    model.warmup(imgsz=(bs, 3, *imgsz))  # no-op on CPU
+    im = torch.zeros(bs, 3, *imgsz, dtype=torch.half if model.fp16 else torch.float, device=model.device)
+    model(im)  # CPU warmup (ONNX Runtime allocates its buffers on the first run)
+    return model
+
+
 @smart_inference_mode()
 def run(
-    source, # source path relative to SERVER_ROOT
-    weights=ROOT / "weights/efficientnet-b0_imgsz128.onnx",  # model.pt path(s)
+    source, # source path relative to SERVER_ROOT, or in-memory images [(name, bytes), ...]
+    weights=DEFAULT_WEIGHTS,  # model.pt path(s)
     data=ROOT / "data/coco128.yaml",  # dataset.yaml path
     imgsz=(128, 128),  # inference size (height, width)
     device="cpu",  # cuda device, i.e. 0 or 0,1,2,3 or cpu
@@ -123,182 +153,107 @@ def run(
     concat_csv=False,  # concatenate metadata .csv files and append classification results
     new_csv=False,  # create new .csv file with classification results
     save_img=False,
+    model=None,  # preloaded model from load_model(), skips model setup
+    max_batch=32,  # maximum number of images per forward pass
+    topk=5,  # number of classes returned with their mean probability
 ):
-    source = f"{SERVER_ROOT}/{source}"  # add tracking ID to source path
+    in_memory = not isinstance(source, (str, Path))
+    if not in_memory:
+        source = f"{SERVER_ROOT}/{source}"  # add tracking ID to source path
     # Directories
     save_dir = Path(os.path.join(Path(project), "results"))
     save_dir.mkdir(parents=True, exist_ok=True)  # make dir
 
     # Load model
-    device = select_device(device)
-    model = DetectMultiBackend(weights, device=device, dnn=dnn, data=data, fp16=half)
-    stride, names, pt = model.stride, model.names, model.pt
+    if model is None:
+        model = load_model(weights, data=data, imgsz=imgsz, device=device, half=half, dnn=dnn)
+    device = model.device
+    stride, names = model.stride, model.names
     imgsz = check_img_size(imgsz, s=stride)  # check image size
 
     # Dataloader
-    bs = 1  # batch_size
-    dataset = LoadImages(source, img_size=imgsz, transforms=classify_transforms(imgsz[0]), vid_stride=vid_stride)
-
-    # Create empty lists to save image filename and top1,top2,top3 class + probability
-    lst_img = []
-    lst_top1 = []
-    lst_top2 = []
-    lst_top3 = []
-    lst_top1_prob = []
-    lst_top2_prob = []
-    lst_top3_prob = []
-
-    # Set start time of inference
-    start_inference = time.monotonic()
-
-    # Run inference
-    model.warmup(imgsz=(1 if pt else bs, 3, *imgsz))  # warmup
-    seen, windows, dt = 0, [], (Profile(device=device), Profile(device=device), Profile(device=device))
-    for path, im, im0s, vid_cap, s in dataset:
-        with dt[0]:
-            im = torch.Tensor(im).to(model.device)
-            im = im.half() if model.fp16 else im.float()  # uint8 to fp16/32
-            if len(im.shape) == 3:
-                im = im[None]  # expand for batch dim
-
-        # Inference
-        with dt[1]:
-            results = model(im)
-
-        # Post-process
-        with dt[2]:
-            pred = F.softmax(results, dim=1)  # probabilities
-
-        # Process predictions
-        for i, prob in enumerate(pred):  # per image
-            seen += 1
-            p, im0, frame = path, im0s.copy(), getattr(dataset, "frame", 0)
-
-            p = Path(p)  # to Path
-
-            save_path = str(save_dir / p.name)  # im.jpg
-            txt_path = str(save_dir / "labels" / p.stem) + ("" if dataset.mode == "image" else f"_{frame}")  # im.txt
-
-            s += "%gx%g " % im.shape[2:]  # print string
-            annotator = Annotator(im0, example=str(names), pil=True)
-
-            # Print results
-            top5i = prob.argsort(0, descending=True)[:5].tolist()  # top 5 indices
-            s += f"{', '.join(f'{names[j]} {prob[j]:.2f}' for j in top5i)}, "
-
-            # Write results
-            # if not sort_top1:
-            #     if save_img or view_img:
-            #         text = f"{names[top5i[0]]}\n{prob[top5i[0]]:.2f}"
-            #         annotator.text([2, 2], text, txt_color=(255, 255, 255))
-            # if save_txt:  # Write to file
-            #     text = "\n".join(f"{prob[j]:.2f} {names[j]}" for j in top5i)
-            #     with open(f"{txt_path}.txt", "a") as f:
-            #         f.write(text + "\n")
-
-            # Write image filename and prediction results to lists
-            # lst_img.append(f"{p.name}")
-            # lst_top1.append(f"{names[top5i[0]]}")
-            # lst_top2.append(f"{names[top5i[1]]}")
-            # lst_top3.append(f"{names[top5i[2]]}")
-            # lst_top1_prob.append(f"{prob[top5i[0]]:.2f}")
-            # lst_top2_prob.append(f"{prob[top5i[1]]:.2f}")
-            # lst_top3_prob.append(f"{prob[top5i[2]]:.2f}")
-
-            # Print time (inference-only)
-            LOGGER.info(f"{s}{dt[1].dt * 1E3:.1f}ms")
-
-            return {
-                "top1": names[top5i[0]],
-                "top1_prob": round(float(prob[top5i[0]]), 2),
-            }
-
-            # Stream results
-            # im0 = annotator.result()
-            # if view_img:
-            #     if platform.system() == "Linux" and p not in windows:
-            #         windows.append(p)
-            #         cv2.namedWindow(str(p), cv2.WINDOW_NORMAL | cv2.WINDOW_KEEPRATIO)  # allow window resize (Linux)
-            #         cv2.resizeWindow(str(p), im0.shape[1], im0.shape[0])
-            #     cv2.imshow(str(p), im0)
-            #     cv2.waitKey(1)  # 1 millisecond
-
-            # Save results
-            # if save_img:
-            #     if dataset.mode == "image":
-            #         if sort_top1 and not sort_prob:
-            #             Path(f"{save_path}/top1_classes/{names[top5i[0]]}").mkdir(parents=True, exist_ok=True)
-            #             cv2.imwrite(f"{save_path}/top1_classes/{names[top5i[0]]}/{p.name}", im0)
-            #         elif sort_top1 and sort_prob:
-            #             if prob[top5i[0]] >= 0.8:
-            #                 Path(f"{save_path}/top1_classes/prob_0.8-1.0/{names[top5i[0]]}").mkdir(parents=True, exist_ok=True)
-            #                 cv2.imwrite(f"{save_path}/top1_classes/prob_0.8-1.0/{names[top5i[0]]}/{p.name}", im0)
-            #             elif 0.5 <= prob[top5i[0]] < 0.8:
-            #                 Path(f"{save_path}/top1_classes/prob_0.5-0.8/{names[top5i[0]]}").mkdir(parents=True, exist_ok=True)
-            #                 cv2.imwrite(f"{save_path}/top1_classes/prob_0.5-0.8/{names[top5i[0]]}/{p.name}", im0)
-            #             else:
-            #                 Path(f"{save_path}/top1_classes/prob_0.0-0.5/{names[top5i[0]]}").mkdir(parents=True, exist_ok=True)
-            #                 cv2.imwrite(f"{save_path}/top1_classes/prob_0.0-0.5/{names[top5i[0]]}/{p.name}", im0)
-            #         else:
-            #             cv2.imwrite(save_path, im0)
-            #     else:  # 'video' or 'stream'
-            #         if vid_path[i] != save_path:  # new video
-            #             vid_path[i] = save_path
-            #             if isinstance(vid_writer[i], cv2.VideoWriter):
-            #                 vid_writer[i].release()  # release previous video writer
-            #             if vid_cap:  # video
-            #                 fps = vid_cap.get(cv2.CAP_PROP_FPS)
-            #                 w = int(vid_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            #                 h = int(vid_cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            #             else:  # stream
-            #                 fps, w, h = 30, im0.shape[1], im0.shape[0]
-            #             save_path = str(Path(save_path).with_suffix(".mp4"))  # force *.mp4 suffix on results videos
-            #             vid_writer[i] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (w, h))
-            #         vid_writer[i].write(im0)
-            
-
+    if in_memory:
+        dataset = LoadImageBytes(source, img_size=imgsz, transforms=classify_transforms(imgsz[0]))
+        source = "in-memory images"
+    else:
+        dataset = LoadImages(source, img_size=imgsz, transforms=classify_transforms(imgsz[0]), vid_stride=vid_stride)
+
+    # Run inference on all images of the tracking run, batched
+    dt = (Profile(device=device), Profile(device=device), Profile(device=device))
+    with dt[0]:
+        paths, ims = [], []
+        for path, im, im0s, vid_cap, s in dataset:
+            paths.append(path)
+            ims.append(im)
+    with dt[1]:
+        pred = classify_images(model, ims, max_batch=max_batch)
+    with dt[2]:
+        results = aggregate_predictions(pred.cpu().numpy(), names, topk=topk)
 
     # Print results
+    seen = len(paths)
     t = tuple(x.t / seen * 1e3 for x in dt)  # speeds per image
-    LOGGER.info(f"Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape {(1, 3, *imgsz)}" % t)
-    if save_txt or save_img:
-        s = f"\n{len(list(save_dir.glob('labels/*.txt')))} labels saved to {save_dir / 'labels'}" if save_txt else ""
-        LOGGER.info(f"\nResults saved to {colorstr('bold', save_dir)}{s}")
+    LOGGER.info(
+        f"{source}: {seen} images, top1 {results['top1']} {results['top1_prob']:.2f}, "
+        f"vote {results['vote_top1']} {results['vote_share']:.2f}"
+    )
+    LOGGER.info(f"Speed: %.1fms load + pre-process, %.1fms inference, %.1fms post-process per image at shape {(1, 3, *imgsz)}" % t)
+
+    # Write prediction results per image to .csv
+    if new_csv:
+        top3i = pred.argsort(1, descending=True)[:, :3].tolist()
+        df_results = pd.DataFrame(
+            {"img_name": [Path(p).name for p in paths],
+             "top1": [names[i[0]] for i in top3i],
+             "top1_prob": [round(float(prob[i[0]]), 2) for prob, i in zip(pred, top3i)],
+             "top2": [names[i[1]] for i in top3i],
+             "top2_prob": [round(float(prob[i[1]]), 2) for prob, i in zip(pred, top3i)],
+             "top3": [names[i[2]] for i in top3i],
+             "top3_prob": [round(float(prob[i[2]]), 2) for prob, i in zip(pred, top3i)],
+            })
+        df_results.insert(1, "timestamp", df_results["img_name"].str[:24])
+        df_results.insert(2, "track_ID", df_results["img_name"].str[10:].str.extract("_(.*)_crop", expand=False))
+        df_results.to_csv(f"{save_dir}/{name}_data_classified.csv", index=False)
     if update:
         strip_optimizer(weights[0])  # update model (to fix SourceChangeWarning)
 
-    # Print estimated inference time per image
-    inference_runtime = time.monotonic() - start_inference
-    LOGGER.info(f"\nEstimated inference time per image: {round((inference_runtime / len(lst_img)) * 1000, 2)} ms")
-
-    # Create folder to save results
-    Path(f"{save_dir}/results").mkdir(parents=True, exist_ok=True)
-
-    # Write prediction results to .csv
-    df_results = pd.DataFrame(
-        {"img_name": lst_img,
-         "top1": lst_top1,
-         "top1_prob": lst_top1_prob,
-         "top2": lst_top2,
-         "top2_prob": lst_top2_prob,
-         "top3": lst_top3,
-         "top3_prob": lst_top3_prob
-        })
-    df_results["top1_prob"] = pd.to_numeric(df_results["top1_prob"])
-    df_results["top2_prob"] = pd.to_numeric(df_results["top2_prob"])
-    df_results["top3_prob"] = pd.to_numeric(df_results["top3_prob"])
-    df_results.to_csv(f"{save_dir}/results/pred_results.csv", index=False)
-
-    # Write classification results to new .csv file and extract timestamp + tracking ID
-    if new_csv:
-        df_new = df_results
-        df_new.insert(1, "timestamp", df_new["img_name"].str[:24])
-        df_new.insert(2, "track_ID", df_new["img_name"].str[10:].str.extract("_(.*)_crop"))
-        df_new.to_csv(f"{save_dir}/results/{name}_data_classified.csv", index=False)
-
-    # Print script run time
-    script_runtime = time.monotonic() - start_time
-    LOGGER.info(f"\nScript run time: {round(script_runtime / 60, 3)} min\n")
+    return results
+
+
+def max_batch_size(model):
+    # Return the fixed batch size of the model input, or None if the batch dimension is dynamic
+    if model.onnx and not model.dnn:
+        batch = model.session.get_inputs()[0].shape[0]
+        return batch if isinstance(batch, int) else None
+    if model.xml:
+        return getattr(model, "batch_size", None)  # only set for static OpenVINO models
+    if model.engine:
+        return None if model.dynamic else model.batch_size
+    return None if model.pt or model.jit else 1
+
+
+@smart_inference_mode()
+def predict_probs(model, im):
+    # Run one batched forward pass on a BCHW tensor and return class probabilities
+    im = torch.as_tensor(im).to(model.device)
+    im = im.half() if model.fp16 else im.float()  # uint8 to fp16/32
+    if len(im.shape) == 3:
+        im = im[None]  # expand for batch dim
+    return F.softmax(model(im), dim=1).float()  # probabilities
+
+
+def classify_images(model, ims, max_batch=32):
+    # Classify a list of CHW tensors, stacked into chunks of at most max_batch images per forward pass
+    fixed = max_batch_size(model)
+    if fixed is not None:
+        max_batch = fixed if fixed == 1 else min(max_batch, fixed)
+    pred = []
+    for i in range(0, len(ims), max_batch):
+        batch = torch.stack(ims[i : i + max_batch])
+        if fixed is not None and len(batch) < fixed:  # pad static batch models
+            batch = torch.cat((batch, batch.new_zeros((fixed - len(batch), *batch.shape[1:]))))
+        pred.append(predict_probs(model, batch)[: len(ims[i : i + max_batch])])
+    return torch.cat(pred)
 
 
 def parse_opt():
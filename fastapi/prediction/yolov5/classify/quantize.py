@@ -0,0 +1,265 @@
+# YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
+"""
+Quantize an ONNX classification model to INT8 for ONNX Runtime CPU inference.
+
+Static quantization calibrates the activation ranges on images, e.g. the crops of stored
+tracking runs in 'data/<date>/<run>/', dynamic quantization only quantizes the weights ahead
+of time. The quantized models are compared with the FP32 model on the same images (top1
+agreement, probability error) and on batch latency.
+
+Usage:
+    $ python classify/quantize.py --weights weights/efficientnet-b0_imgsz128.onnx --source ../../data/2024-05-10/
+    $ python classify/quantize.py --weights model.onnx --source ../../data/ --mode static dynamic --batch-sizes 1 32
+
+Output:
+    model_int8.onnx            static (calibrated) INT8 model, served with MODEL_PRECISION=int8
+    model_int8_dynamic.onnx    dynamic INT8 model, served with MODEL_PRECISION=int8-dynamic
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]  # prediction directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
+
+# utils and torch are imported in the functions, the server imports this module only for quantized_weights()
+
+PRECISIONS = {"fp32": "", "int8": "_int8", "int8-dynamic": "_int8_dynamic"}  # precision -> weights file suffix
+
+
+def quantized_weights(weights, precision="fp32"):
+    # Path of the model of a precision next to the FP32 ONNX weights, i.e. model.onnx -> model_int8.onnx
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown model precision {precision!r}, expected one of {list(PRECISIONS)}")
+    weights = Path(weights)
+    return weights.with_name(f"{weights.stem}{PRECISIONS[precision]}{weights.suffix}")
+
+
+def load_images(source, imgsz=128, max_images=256):
+    # Preprocessed CHW float32 images from a directory of images or of tracking runs, evenly sampled in capture order
+    from utils.augmentations import classify_transforms
+    from utils.dataloaders import IMG_FORMATS
+    from utils.general import cv2
+
+    files = sorted(
+        p
+        for p in Path(source).rglob("*")
+        if p.suffix[1:].lower() in IMG_FORMATS and not any(part.startswith(".") for part in p.relative_to(source).parts)
+    )
+    if max_images and len(files) > max_images:
+        files = [files[i * len(files) // max_images] for i in range(max_images)]
+    transforms = classify_transforms(imgsz)
+    images = []
+    for f in files:
+        im = cv2.imread(str(f))  # BGR
+        if im is not None:
+            images.append(transforms(im).numpy())
+    return images
+
+
+def fixed_batch_size(dim):
+    # Batch size of an ONNX input dimension, None if the dimension is dynamic (a symbolic name or unset)
+    return dim if isinstance(dim, int) and dim > 0 else None
+
+
+def batches(images, batch_size):
+    # Stacked batches of batch_size images, the last batch is padded by repeating images from the start
+    for i in range(0, len(images), batch_size):
+        yield np.stack([images[j % len(images)] for j in range(i, i + batch_size)])
+
+
+class ImageCalibrationReader:
+    # onnxruntime.quantization.CalibrationDataReader over batches of preprocessed images
+    def __init__(self, input_name, images, batch_size=8):
+        self.input_name = input_name
+        self.batches = list(batches(images, batch_size))
+        self.rewind()
+
+    def get_next(self):
+        batch = next(self._batches, None)
+        return None if batch is None else {self.input_name: batch}
+
+    def rewind(self):
+        self._batches = iter(self.batches)
+
+
+def quantize(weights, mode="static", images=None, per_channel=True, calibrate_method="minmax", prefix=None):
+    # Quantize an FP32 ONNX model, returns the path of the INT8 model. Static quantization requires calibration images
+    from utils.general import LOGGER, check_requirements, colorstr
+
+    prefix = prefix or colorstr("INT8:")
+    check_requirements(("onnx", "onnxruntime"))
+    import onnx
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    weights = Path(weights)
+    f = quantized_weights(weights, "int8" if mode == "static" else "int8-dynamic")
+    LOGGER.info(f"{prefix} starting {mode} quantization of {weights}...")
+    with tempfile.TemporaryDirectory() as tmp:
+        prepared = Path(tmp, weights.name)
+        quant_pre_process(str(weights), str(prepared))  # shape inference and graph optimization before quantization
+        if mode == "static":
+            assert images, "static quantization requires calibration images, i.e. --source data/<date>/<run>/"
+            model_input = onnx.load(prepared, load_external_data=False).graph.input[0]
+            batch_size = fixed_batch_size(model_input.type.tensor_type.shape.dim[0].dim_value) or 8  # static export: 1
+            quantize_static(
+                str(prepared),
+                str(f),
+                ImageCalibrationReader(model_input.name, images, batch_size),
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=per_channel,
+                calibrate_method={
+                    "minmax": CalibrationMethod.MinMax,
+                    "entropy": CalibrationMethod.Entropy,
+                    "percentile": CalibrationMethod.Percentile,
+                }[calibrate_method],
+            )
+        elif mode == "dynamic":
+            # ConvInteger, which dynamic quantization uses for convolutions, requires uint8 weights
+            quantize_dynamic(str(prepared), str(f), weight_type=QuantType.QUInt8, per_channel=per_channel)
+        else:
+            raise ValueError(f"Unknown quantization mode {mode!r}, expected 'static' or 'dynamic'")
+
+    # Keep the metadata (stride, class names), DetectMultiBackend reads the class names from it
+    source_meta = onnx.load(weights, load_external_data=False).metadata_props
+    model = onnx.load(f)
+    keys = {meta.key for meta in model.metadata_props}
+    for meta in source_meta:
+        if meta.key not in keys:
+            model.metadata_props.add(key=meta.key, value=meta.value)
+    onnx.save(model, f)
+    LOGGER.info(f"{prefix} saved {f} ({f.stat().st_size / 1e6:.1f} MB, FP32 {weights.stat().st_size / 1e6:.1f} MB)")
+    return f
+
+
+def benchmark(weights, images, batch_sizes=(1, 32), iterations=20, warmup=3):
+    # Probabilities of the images and milliseconds per batch {batch_size: [ms, ...]} of an ONNX model. A model
+    # exported with a static batch size, i.e. export.py without --dynamic, is only timed at that batch size
+    import onnxruntime
+
+    from utils.general import LOGGER
+
+    session = onnxruntime.InferenceSession(str(weights), providers=["CPUExecutionProvider"])
+    name = session.get_inputs()[0].name
+    fixed = fixed_batch_size(session.get_inputs()[0].shape[0])
+    probs = []
+    for im in batches(images, fixed or max(batch_sizes)):
+        y = session.run(None, {name: im})[0]
+        y = np.exp(y - y.max(1, keepdims=True))
+        probs.append(y / y.sum(1, keepdims=True))  # softmax, as in classify_images()
+    if fixed and set(batch_sizes) - {fixed}:
+        LOGGER.warning(
+            f"WARNING ⚠️ {Path(weights).name} has a static batch size of {fixed}, skipping batch sizes "
+            f"{sorted(set(batch_sizes) - {fixed})}, export with --dynamic to benchmark them"
+        )
+        batch_sizes = [fixed]
+    times = {}
+    for batch_size in batch_sizes:
+        im = np.stack([images[i % len(images)] for i in range(batch_size)])
+        for _ in range(warmup):
+            session.run(None, {name: im})
+        times[batch_size] = []
+        for _ in range(iterations):
+            t = time.perf_counter()
+            session.run(None, {name: im})
+            times[batch_size].append((time.perf_counter() - t) * 1000)
+    return np.concatenate(probs)[: len(images)], times
+
+
+def report(weights, quantized, images, batch_sizes=(1, 32), iterations=20):
+    # Accuracy vs. latency of the quantized models compared with the FP32 model, one row per model
+    from utils.general import LOGGER
+
+    reference, reference_times = benchmark(weights, images, batch_sizes, iterations)
+    rows = []
+    for f in [weights, *quantized]:
+        probs, times = (reference, reference_times) if f == weights else benchmark(f, images, batch_sizes, iterations)
+        row = {
+            "model": Path(f).name,
+            "MB": Path(f).stat().st_size / 1e6,
+            "top1 agreement": float((probs.argmax(1) == reference.argmax(1)).mean()),
+            "mean abs prob error": float(np.abs(probs - reference).mean()),
+            "max abs prob error": float(np.abs(probs - reference).max()),
+        }
+        for batch_size in batch_sizes:
+            if batch_size not in times or batch_size not in reference_times:
+                continue  # not supported by a model with a static batch size
+            p50, p50_reference = statistics.median(times[batch_size]), statistics.median(reference_times[batch_size])
+            row[f"bs{batch_size} ms"] = p50
+            row[f"bs{batch_size} speedup"] = p50_reference / p50
+        rows.append(row)
+
+    LOGGER.info(f"\nAccuracy vs. latency on {len(images)} images (agreement and errors relative to FP32)")
+    columns = list(dict.fromkeys(k for row in rows for k in row))
+    LOGGER.info(" | ".join(f"{k:>20}" for k in columns))
+    for row in rows:
+        values = (row.get(k, "-") for k in columns)
+        LOGGER.info(" | ".join(f"{v:>20.3f}" if isinstance(v, float) else f"{v:>20}" for v in values))
+    return rows
+
+
+def run(
+    weights=ROOT / "weights/efficientnet-b0_imgsz128.onnx",  # FP32 ONNX model path
+    source=None,  # calibration and evaluation images, i.e. data/<date>/<run>/ or data/
+    imgsz=128,  # inference size (pixels)
+    mode=("static", "dynamic"),  # quantization modes
+    max_images=256,  # maximum number of calibration and evaluation images
+    per_channel=True,  # per-channel weight quantization
+    calibrate_method="minmax",  # static calibration method: minmax, entropy or percentile
+    batch_sizes=(1, 32),  # batch sizes of the latency benchmark
+    iterations=20,  # timed runs per batch size
+):
+    from utils.general import LOGGER
+
+    images = load_images(source, imgsz, max_images) if source else []
+    if source:
+        LOGGER.info(f"Loaded {len(images)} images from {source}")
+    if "static" in mode and not images:
+        LOGGER.warning(
+            "WARNING ⚠️ static quantization requires calibration images, i.e. --source data/<date>/<run>/, skipping"
+        )
+        mode = [m for m in mode if m != "static"]
+    quantized = [quantize(weights, m, images, per_channel, calibrate_method) for m in mode]
+    if not images:  # no images to compare on, benchmark with random ones
+        images = list(np.random.default_rng(0).random((max(batch_sizes), 3, imgsz, imgsz), dtype=np.float32))
+    return report(weights, quantized, images, batch_sizes, iterations)
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weights", type=str, default=ROOT / "weights/efficientnet-b0_imgsz128.onnx", help="model path")
+    parser.add_argument("--source", type=str, help="calibration images, i.e. data/<date>/<run>/ or data/")
+    parser.add_argument("--imgsz", "--img", "--img-size", type=int, default=128, help="inference size")
+    parser.add_argument("--mode", nargs="+", default=["static", "dynamic"], help="static and/or dynamic")
+    parser.add_argument("--max-images", type=int, default=256, help="maximum number of images")
+    parser.add_argument("--no-per-channel", dest="per_channel", action="store_false", help="per-tensor weights")
+    parser.add_argument("--calibrate-method", default="minmax", help="minmax, entropy or percentile")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 32], help="benchmark batch sizes")
+    parser.add_argument("--iterations", type=int, default=20, help="timed runs per batch size")
+    opt = parser.parse_args()
+    from utils.general import print_args
+
+    print_args(vars(opt))
+    return opt
+
+
+def main(opt):
+    run(**vars(opt))
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
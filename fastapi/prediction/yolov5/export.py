@@ -23,6 +23,7 @@ Requirements:
 
 Usage:
     $ python export.py --weights yolov5s.pt --include torchscript onnx openvino engine coreml tflite ...
+    $ python export.py --weights yolov5s-cls.pt --include onnx --int8 --data path/to/images/  # + INT8 ONNX
 
 Inference:
     $ python detect.py --weights yolov5s.pt                 # PyTorch
@@ -218,6 +219,21 @@ def export_onnx(model, im, file, opset, dynamic, simplify, prefix=colorstr("ONNX
     return f, model_onnx
 
 
+@try_export
+def export_onnx_int8(file, imgsz, data, prefix=colorstr("ONNX INT8:")):
+    # YOLOv5 ONNX INT8 quantization for ONNX Runtime, calibrated on the images in data if it is a directory
+    from classify.quantize import load_images, quantize
+
+    source = Path(data)
+    images = load_images(source, imgsz[0]) if source.is_dir() else []
+    if images:
+        f = quantize(file, "static", images, prefix=prefix)
+    else:
+        LOGGER.info(f"{prefix} no images in --data for calibration, quantizing dynamically")
+        f = quantize(file, "dynamic", prefix=prefix)
+    return str(f), None
+
+
 @try_export
 def export_openvino(file, metadata, half, int8, data, prefix=colorstr("OpenVINO:")):
     # YOLOv5 OpenVINO export
@@ -743,7 +759,7 @@ def run(
     inplace=False,  # set YOLOv5 Detect() inplace=True
     keras=False,  # use Keras
     optimize=False,  # TorchScript: optimize for mobile
-    int8=False,  # CoreML/TF INT8 quantization
+    int8=False,  # CoreML/TF/ONNX INT8 quantization
     per_tensor=False,  # TF per tensor quantization
     dynamic=False,  # ONNX/TF/TensorRT: dynamic axes
     simplify=False,  # ONNX: simplify model
@@ -807,6 +823,8 @@ def run(
         f[1], _ = export_engine(model, im, file, half, dynamic, simplify, workspace, verbose)
     if onnx or xml:  # OpenVINO requires ONNX
         f[2], _ = export_onnx(model, im, file, opset, dynamic, simplify)
+        if onnx and int8 and f[2]:  # ONNX Runtime INT8 model next to the ONNX model, not an --include format
+            f.append(export_onnx_int8(Path(f[2]), imgsz, data)[0])
     if xml:  # OpenVINO
         f[3], _ = export_openvino(file, metadata, half, int8, data)
     if coreml:  # CoreML
@@ -879,7 +897,7 @@ def parse_opt(known=False):
     parser.add_argument("--inplace", action="store_true", help="set YOLOv5 Detect() inplace=True")
     parser.add_argument("--keras", action="store_true", help="TF: use Keras")
     parser.add_argument("--optimize", action="store_true", help="TorchScript: optimize for mobile")
-    parser.add_argument("--int8", action="store_true", help="CoreML/TF/OpenVINO INT8 quantization")
+    parser.add_argument("--int8", action="store_true", help="CoreML/TF/OpenVINO/ONNX INT8 quantization")
     parser.add_argument("--per-tensor", action="store_true", help="TF per-tensor quantization")
     parser.add_argument("--dynamic", action="store_true", help="ONNX/TF/TensorRT: dynamic axes")
     parser.add_argument("--simplify", action="store_true", help="ONNX: simplify model")
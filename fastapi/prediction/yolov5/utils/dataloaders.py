@@ -400,6 +400,45 @@ class LoadImages:
         return self.nf  # number of files
 
 
+class LoadImageBytes:
+    # Image dataloader for encoded images held in memory, i.e. uploaded files: [(name, bytes), ...]
+    def __init__(self, images, img_size=640, stride=32, auto=True, transforms=None):
+        self.files = list(images)
+        self.nf = len(self.files)  # number of files
+        self.img_size = img_size
+        self.stride = stride
+        self.mode = "image"
+        self.auto = auto
+        self.transforms = transforms  # optional
+        self.cap = None
+        assert self.nf > 0, "No images found"
+
+    def __iter__(self):
+        self.count = 0
+        return self
+
+    def __next__(self):
+        if self.count == self.nf:
+            raise StopIteration
+        path, buffer = self.files[self.count]
+        self.count += 1
+        im0 = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_COLOR)  # BGR
+        assert im0 is not None, f"Image Not Decodable {path}"
+        s = f"image {self.count}/{self.nf} {path}: "
+
+        if self.transforms:
+            im = self.transforms(im0)  # transforms
+        else:
+            im = letterbox(im0, self.img_size, stride=self.stride, auto=self.auto)[0]  # padded resize
+            im = im.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
+            im = np.ascontiguousarray(im)  # contiguous
+
+        return path, im, im0, self.cap, s
+
+    def __len__(self):
+        return self.nf  # number of files
+
+
 class LoadStreams:
     # YOLOv5 streamloader, i.e. `python detect.py --source 'rtsp://example.com/media.mp4'  # RTSP, RTMP, HTTP streams`
     def __init__(self, sources="file.streams", img_size=640, stride=32, auto=True, transforms=None, vid_stride=1):
@@ -1,19 +1,74 @@
 import os
-from fastapi.responses import FileResponse
+import aiofiles
+import asyncio
 import auth
-import shutil
-import pandas as pd
-
+import csv
+import functools
+import io
+import itertools
+import json
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
 from datetime import datetime
-from fastapi import BackgroundTasks, FastAPI, UploadFile, Body, Depends
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request, Response, UploadFile, Body, Depends, Query
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.security.api_key import APIKey
 
-from prediction.yolov5.classify.predict import run as run_classification
+from archive_cache import ArchiveCache
+from classification import DEFAULT_WEIGHTS, classify_run
+from image_loader import PrefetchLoader
+from inference_pool import InferencePool
+from inference_scheduler import InferenceScheduler
+from job_queue import JobQueue, QueueFull
+from model_registry import ModelRegistry
+from onnx_classifier import OnnxModelInfo
+from onnx_session import SessionProfile
+from storage import COLUMNS, ClassificationStore, migrate_csv, to_arrow
+from thumbnails import FORMATS as THUMBNAIL_FORMATS, IMAGE_SUFFIXES, ThumbnailCache, representative_image, run_images
+from tracking_run_index import TrackingRunIndex
+from zipstream import CHUNK_SIZE, directory_entries, stream_zip
+from prediction.yolov5.classify.quantize import quantized_weights
 
 import threading
 
-CLASSIFICATION_DATA_PATH = Path(".", "data", "classification_data.csv")
+CLASSIFICATION_DATA_PATH = Path(".", "data", "classification_data.csv")  # legacy, migrated to the database
+CLASSIFICATION_MIGRATED_PATH = CLASSIFICATION_DATA_PATH.with_suffix(".csv.migrated")  # the CSV after the migration
+CLASSIFICATION_DB_PATH = Path(".", "data", "classification_data.db")
+# "fp32", or "int8" / "int8-dynamic" for the model quantized with classify/quantize.py next to the weights
+MODEL_PRECISION = os.getenv("MODEL_PRECISION") or "fp32"
+MODEL_WEIGHTS = quantized_weights(os.getenv("MODEL_WEIGHTS") or DEFAULT_WEIGHTS, MODEL_PRECISION)
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH") or 32)
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS") or 10)
+# Number of inference worker processes, 0 runs inference in the server process
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS") or 0)
+INFERENCE_WORKER_THREADS = int(os.getenv("INFERENCE_WORKER_THREADS") or 0) or None  # default: cores / workers
+# ONNX Runtime session settings, thread counts of 0 use one thread per core
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS") or 0)
+ONNX_INTER_OP_THREADS = int(os.getenv("ONNX_INTER_OP_THREADS") or 0)
+ONNX_EXECUTION_MODE = os.getenv("ONNX_EXECUTION_MODE") or "sequential"  # or "parallel"
+ONNX_GRAPH_OPTIMIZATION = os.getenv("ONNX_GRAPH_OPTIMIZATION") or "all"  # "disable", "basic", "extended" or "all"
+ONNX_CACHE_PATH = Path(".", "data", ".cache", "onnx")
+# Threads decoding and resizing the images of /classify, 0 decodes them in the request thread,
+# and number of batches decoded ahead while the previous batch is classified
+DECODE_THREADS = int(os.getenv("DECODE_THREADS") or 2)
+DECODE_PREFETCH = int(os.getenv("DECODE_PREFETCH") or 2)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS") or 4)
+# "sync": /classify responds with the classification result, "queue": /classify stores the files,
+# queues a classification job and responds with 202 and the job id right away
+INGEST_MODE = os.getenv("INGEST_MODE") or "sync"
+INGEST_QUEUE_PATH = Path(".", "data", ".queue", "jobs.db")
+INGEST_QUEUE_WORKERS = int(os.getenv("INGEST_QUEUE_WORKERS") or 2)
+INGEST_QUEUE_MAX = int(os.getenv("INGEST_QUEUE_MAX") or 100)
+ARCHIVE_CACHE_PATH = Path(".", "data", ".cache", "archives")
+ARCHIVE_CACHE_MAX_MB = int(os.getenv("ARCHIVE_CACHE_MAX_MB") or 200)
+THUMBNAIL_CACHE_PATH = Path(".", "data", ".cache", "thumbnails")
+THUMBNAIL_CACHE_MAX_MB = int(os.getenv("THUMBNAIL_CACHE_MAX_MB") or 500)
+THUMBNAIL_SIZES = [int(size) for size in (os.getenv("THUMBNAIL_SIZES") or "128,256").split(",")]
+THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT") or "webp"
+RUN_INDEX_RECONCILE_S = float(os.getenv("RUN_INDEX_RECONCILE_S") or 60)
 EXCLUDE_CLASSES = [
     "none_dirt",
     "none_bg",
@@ -24,110 +79,554 @@ EXCLUDE_CLASSES = [
 
 lock = threading.Lock()
 
+# Bounded pool for the blocking part of /classify (image loading, waiting for inference, database commit)
+ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+
+onnx_session_profile = SessionProfile(
+    intra_op_threads=ONNX_INTRA_OP_THREADS,
+    inter_op_threads=ONNX_INTER_OP_THREADS,
+    execution_mode=ONNX_EXECUTION_MODE,
+    graph_optimization=ONNX_GRAPH_OPTIMIZATION,
+    cache_dir=ONNX_CACHE_PATH,
+)
+
+inference_pool = (
+    InferencePool(
+        MODEL_WEIGHTS,
+        workers=INFERENCE_WORKERS,
+        max_batch=INFERENCE_MAX_BATCH,
+        threads=INFERENCE_WORKER_THREADS,
+        session_profile=onnx_session_profile,
+    )
+    if INFERENCE_WORKERS
+    else None
+)
+
+# With an inference pool, this process only preprocesses the images and aggregates the results:
+# of ONNX models only the class names and the input size are read, the workers hold the model
+model_registry = ModelRegistry(
+    loader=OnnxModelInfo if inference_pool and MODEL_WEIGHTS.suffix == ".onnx" else onnx_session_profile.load
+)
+
+image_loader = (
+    PrefetchLoader(threads=DECODE_THREADS, prefetch=DECODE_PREFETCH, batch_size=INFERENCE_MAX_BATCH)
+    if DECODE_THREADS
+    else None
+)
+
+inference_scheduler = InferenceScheduler(
+    lambda: model_registry.get(MODEL_WEIGHTS),
+    max_batch_size=INFERENCE_MAX_BATCH,
+    max_wait_ms=INFERENCE_MAX_WAIT_MS,
+    classify_fn=inference_pool.classify if inference_pool else None,
+    workers=INFERENCE_WORKERS or 1,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load and warm up the classification model once, instead of on every request
+    model = model_registry.load(MODEL_WEIGHTS)
+    if inference_pool:
+        # The shared memory of the workers is sized for the model
+        inference_pool.num_classes = len(model.names)
+        inference_pool.input_shape = (3, *model.imgsz)
+        inference_pool.start()
+    inference_scheduler.start()
+    run_index.start()
+    job_queue.start()  # also in sync mode, to finish jobs queued before a switch
+    yield
+    job_queue.stop()
+    ingest_executor.shutdown()
+    inference_scheduler.stop()
+    if image_loader:
+        image_loader.close()
+    if inference_pool:
+        inference_pool.stop()
+    run_index.stop()
+
+
 app = FastAPI(
     title="WasKrabbeltDa? - Backend",
     description="""Obtain data from your local insect-detect camera.""",
     version="0.0.1",
+    lifespan=lifespan,
 )
 
-def remove_file(path: str) -> None:
-    os.unlink(path)
+
+def tracking_run_archive_response(run_path: Path, filename: str) -> StreamingResponse:
+    # Serve the cached archive of a tracking run, built on first use if it is missing or outdated. The archive
+    # is opened before the response is returned, so an eviction in between can't delete it
+    f = archive_cache.open(run_path)
+
+    def chunks():
+        with f:
+            while chunk := f.read(CHUNK_SIZE):
+                yield chunk
+
+    return StreamingResponse(
+        chunks(),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Content-Length": str(os.fstat(f.fileno()).st_size),
+        },
+    )
+
+
+def zip_response(entries, filename: str) -> StreamingResponse:
+    # Stream a zip archive to the client while it is being built, no temporary file
+    return StreamingResponse(
+        stream_zip(entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def is_date(date: str) -> bool:
+    try:
+        return datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d") == date
+    except ValueError:
+        return False
+
+
+def tracking_run_path(date: str, tracking_run: str) -> Path:
+    # Directory data/<date>/<run> of a stored tracking run. Other directories of the data volume,
+    # i.e. the caches in data/.cache, are not tracking runs and must not be archived or served.
+    data_path = Path("data").resolve()
+    path = Path(data_path, date, tracking_run).resolve()
+    if (
+        not is_date(date)
+        or tracking_run.startswith(".")
+        or path.parent.parent != data_path
+        or not path.is_dir()
+    ):
+        raise HTTPException(status_code=404, detail="Tracking run not found")
+    return path
+
+
+def tracking_run_image_path(date: str, tracking_run: str, filename: str) -> Path:
+    path = Path(tracking_run_path(date, tracking_run), filename)
+    if Path(filename).name != filename or path.suffix.lower() not in IMAGE_SUFFIXES or not path.is_file():
+        raise HTTPException(status_code=404, detail="Image not found")
+    return path
+
+
+def thumbnail_response(image_path: Path, size: int | None, fmt: str | None) -> FileResponse:
+    # Serve a cached thumbnail of the configured size nearest to the requested one, by default the smallest one,
+    # so clients keep working when THUMBNAIL_SIZES changes
+    size = thumbnail_cache.nearest_size(size) if size else thumbnail_cache.sizes[0]
+    if fmt is not None and fmt not in THUMBNAIL_FORMATS:
+        raise HTTPException(status_code=422, detail=f"format must be one of {list(THUMBNAIL_FORMATS)}")
+    return FileResponse(
+        thumbnail_cache.get_or_build(image_path, size, fmt),
+        media_type=THUMBNAIL_FORMATS[fmt or thumbnail_cache.default_format][1],
+        headers={"Cache-Control": "private, max-age=86400", "X-Image-Name": image_path.name},
+    )
+
+
+def classification_csv():
+    # Classification data in the format of the former classification_data.csv
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    yield buffer.getvalue().encode()
+    for row in store.all():
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        yield buffer.getvalue().encode()
+
+
+def most_recent_run_or_404() -> tuple:
+    date, tracking_run = run_index.most_recent_run()
+    if tracking_run is None:
+        raise HTTPException(status_code=404, detail="No tracking runs stored yet")
+    return date, tracking_run
+
+
+def is_not_modified(request: Request, etag: str, last_modified: datetime) -> bool:
+    # Evaluate the conditional request headers, If-None-Match takes precedence over If-Modified-Since
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return last_modified.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+JSON_MEDIA_TYPE = "application/json"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+
+def negotiate_media_type(request: Request) -> str:
+    # Pick the classification data format from the Accept header, JSON unless Arrow or Parquet is asked for
+    accept = request.headers.get("accept", "")
+    if ARROW_MEDIA_TYPE in accept:
+        return ARROW_MEDIA_TYPE
+    if PARQUET_MEDIA_TYPE in accept or "application/x-parquet" in accept:
+        return PARQUET_MEDIA_TYPE
+    return JSON_MEDIA_TYPE
+
+
+def serialize_classifications(rows: list, media_type: str) -> bytes:
+    if media_type == JSON_MEDIA_TYPE:
+        return json.dumps(rows).encode()
+    table = to_arrow(rows)
+    if media_type == ARROW_MEDIA_TYPE:
+        import pyarrow as pa
+
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    import pyarrow.parquet as pq
+
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    return buffer.getvalue()
+
 
 # Setup
-if not CLASSIFICATION_DATA_PATH.exists():
-    data = pd.DataFrame(
-        columns=[
-            "date",
-            "start_time",
-            "end_time",
-            "duration_s",
-            "track_ID",
-            "track_ID_imgs",
-            "tracking_run_ID",
-            "top1",
-            "top1_prob",
-        ]
+store = ClassificationStore(CLASSIFICATION_DB_PATH)
+run_index = TrackingRunIndex(Path("data"), reconcile_interval_s=RUN_INDEX_RECONCILE_S)
+archive_cache = ArchiveCache(ARCHIVE_CACHE_PATH, max_bytes=ARCHIVE_CACHE_MAX_MB * 1024 * 1024)
+thumbnail_cache = ThumbnailCache(
+    THUMBNAIL_CACHE_PATH,
+    max_bytes=THUMBNAIL_CACHE_MAX_MB * 1024 * 1024,
+    sizes=THUMBNAIL_SIZES,
+    default_format=THUMBNAIL_FORMAT,
+)
+classification_payload_cache = {}  # media type -> (store.last_id, serialized /data/classification payload)
+
+if CLASSIFICATION_DATA_PATH.exists() and not store.count():
+    # One-shot migration of the former CSV storage
+    migrate_csv(CLASSIFICATION_DATA_PATH, store)
+    CLASSIFICATION_DATA_PATH.rename(CLASSIFICATION_MIGRATED_PATH)
+
+
+async def save_file(content: bytes, file_path: Path) -> None:
+    # Write an uploaded file to disk without blocking the event loop
+    async with aiofiles.open(file_path, "wb") as file_object:
+        await file_object.write(content)
+
+
+def classify_tracking_run(images: list) -> dict:
+    # Run classification on all images of the run, obtain mean of classification results.
+    # The images are decoded from memory by the image loader and inference is batched together
+    # with concurrent requests by the scheduler.
+    return classify_run(
+        model_registry.get(MODEL_WEIGHTS), images, scheduler=inference_scheduler, loader=image_loader
+    )
+
+
+def store_classification(new_row: dict, idempotent: bool = False) -> None:
+    # With idempotent=True a tracking run is stored only once, so a queued job that is processed again after
+    # a restart doesn't add a second row. Uploads of the sync ingest mode are always stored
+    with lock:
+        if idempotent:
+            store.insert_run(new_row)
+        else:
+            store.insert(new_row)
+
+
+def missing_files(data_path: Path, filenames: list) -> list:
+    # Names of the files that are not stored in data_path yet
+    return [filename for filename in filenames if not Path(data_path, filename).exists()]
+
+
+def remove_files(data_path: Path, filenames: list) -> None:
+    # Delete stored files of a run that was not accepted, and its directories if they are empty now
+    for filename in filenames:
+        Path(data_path, filename).unlink(missing_ok=True)
+    for path in (data_path, data_path.parent):
+        try:
+            path.rmdir()
+        except OSError:  # not empty
+            break
+
+
+def tracking_run_id(tracking_id: int, end_date: datetime) -> str:
+    return f"ID{tracking_id}-{end_date.strftime('%H-%M-%S')}"
+
+
+def tracking_run_data_path(tracking_id: int, end_date: datetime) -> Path:
+    return Path("data", f"{end_date.strftime('%Y-%m-%d')}", tracking_run_id(tracking_id, end_date))
+
+
+def classification_row(
+    tracking_id: int, start_date: datetime, end_date: datetime, duration_s: int, image_count: int, results: dict
+) -> dict:
+    return {
+        "date": end_date.date(),
+        "start_time": start_date,
+        "end_time": end_date,
+        "duration_s": duration_s,
+        "track_ID": tracking_id,
+        "track_ID_imgs": image_count,
+        "tracking_run_ID": tracking_run_id(tracking_id, end_date),
+        "top1": results["top1"],
+        "top1_prob": results["top1_prob"],
+    }
+
+
+def process_classification_job(payload: dict) -> dict:
+    # Worker side of the queued ingest mode: classify the stored files of a run and store the results
+    start_date = datetime.fromisoformat(payload["start_date"])
+    end_date = datetime.fromisoformat(payload["end_date"])
+    data_path = tracking_run_data_path(payload["tracking_id"], end_date)
+    images = [(filename, Path(data_path, filename).read_bytes()) for filename in payload["files"]]
+    results = classify_tracking_run(images)
+    new_row = classification_row(
+        payload["tracking_id"], start_date, end_date, payload["duration_s"], len(images), results
     )
-    data.to_csv(CLASSIFICATION_DATA_PATH, index=False)
+    store_classification(new_row, idempotent=True)
+    run_index.update(data_path)
+    archive_cache.build(data_path)
+    thumbnail_cache.build(data_path, images)
+    return {"tracking_run_ID": new_row["tracking_run_ID"], "top1": results["top1"], "top1_prob": results["top1_prob"]}
+
+
+job_queue = JobQueue(
+    INGEST_QUEUE_PATH, process_classification_job, workers=INGEST_QUEUE_WORKERS, max_pending=INGEST_QUEUE_MAX
+)
 
 
 @app.post("/classify/{tracking_id}")
-def classify(
+async def classify(
     files: list[UploadFile],
     tracking_id: int,
+    background_tasks: BackgroundTasks,
     api_key: APIKey = Depends(auth.get_api_key),
     start_date: datetime = Body(...),
     end_date: datetime = Body(...),
     duration_s: int = Body(...),
 ):
-    lock.acquire()
+    loop = asyncio.get_running_loop()
 
-    # Store the uploaded tracking files
     # get current date
-    tracking_run_id = f"ID{tracking_id}-{end_date.strftime('%H-%M-%S')}"
-    data_path = Path("data", f"{end_date.strftime('%Y-%m-%d')}", tracking_run_id)
-    data_path.mkdir(exist_ok=True, parents=True)#TODO: exist_ok logic
-    for file in files:
-        file_path = data_path / file.filename
-        with open(file_path, "wb+") as file_object:
-            shutil.copyfileobj(file.file, file_object)
-
-    # Run classification, obtain mean of classification results
-    classification_results = run_classification(data_path)
+    data_path = tracking_run_data_path(tracking_id, end_date)
+    # The blocking SQLite and filesystem calls of the handler run in the executor, not on the event loop
+    await loop.run_in_executor(ingest_executor, functools.partial(data_path.mkdir, exist_ok=True, parents=True))#TODO: exist_ok logic
+    images = [(Path(file.filename).name, await file.read()) for file in files]
+
+    if INGEST_MODE == "queue":
+        # Store the files and leave the classification to the job queue workers
+        if await loop.run_in_executor(ingest_executor, job_queue.full):
+            raise HTTPException(status_code=503, detail="Too many pending classification jobs", headers={"Retry-After": "60"})
+        new_files = await loop.run_in_executor(ingest_executor, missing_files, data_path, [name for name, _ in images])
+        await asyncio.gather(*(save_file(content, data_path / filename) for filename, content in images))
+        payload = {
+            "tracking_id": tracking_id,
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat(),
+            "duration_s": duration_s,
+            "files": [filename for filename, _ in images],
+        }
+        try:
+            job_id = await loop.run_in_executor(ingest_executor, job_queue.submit, payload)
+        except QueueFull as e:
+            # The queue filled up meanwhile, the files of the rejected run would be orphaned
+            await loop.run_in_executor(ingest_executor, remove_files, data_path, new_files)
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "60"})
+        return JSONResponse(
+            {"success": True, "job_id": job_id, "status_url": f"/jobs/{job_id}"},
+            status_code=202,
+            headers={"Location": f"/jobs/{job_id}"},
+        )
+
+    # Store the uploaded tracking files while the images are classified from memory
+    classification_results, *_ = await asyncio.gather(
+        loop.run_in_executor(ingest_executor, classify_tracking_run, images),
+        *(save_file(content, data_path / filename) for filename, content in images),
+    )
 
     # Store classification results
-    new_row = {
-        "date": end_date.date(),
-        "start_time": start_date,
-        "end_time": end_date,
-        "duration_s": duration_s,
-        "track_ID": tracking_id,
-        "track_ID_imgs": len(files),
-        "tracking_run_ID": tracking_run_id,
-        "top1": classification_results["top1"],
-        "top1_prob": classification_results["top1_prob"],
-    }
+    new_row = classification_row(tracking_id, start_date, end_date, duration_s, len(files), classification_results)
+    await loop.run_in_executor(ingest_executor, store_classification, new_row)
+    await loop.run_in_executor(ingest_executor, run_index.update, data_path)
 
-    data = pd.read_csv(CLASSIFICATION_DATA_PATH)
-    data.loc[len(data)] = new_row
-    data.to_csv(CLASSIFICATION_DATA_PATH, index=False)
-
-    lock.release()
+    # Build the archive and the thumbnails of the run once, before the dashboards ask for them
+    background_tasks.add_task(archive_cache.build, data_path)
+    background_tasks.add_task(thumbnail_cache.build, data_path, images)
 
     return {"success": True}
 
 
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str, api_key: APIKey = Depends(auth.get_api_key)):
+    # Status (queued, running, done or failed) and result of a classification job of the queued ingest mode
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/metrics/ingest")
+def get_ingest_metrics(api_key: APIKey = Depends(auth.get_api_key)):
+    return job_queue.metrics()
+
+
+@app.get("/metrics/inference")
+def get_inference_metrics(api_key: APIKey = Depends(auth.get_api_key)):
+    return inference_scheduler.metrics()
+
+
+def stats_exclude_classes(insects_only: bool) -> list:
+    return EXCLUDE_CLASSES if insects_only else []
+
+
+# Pre-aggregated statistics for the dashboard, served from the rollup table that is updated with every insert
+@app.get("/stats/hourly")
+def get_hourly_stats(date: str, insects_only: bool = True, api_key: APIKey = Depends(auth.get_api_key)):
+    counts = {row["hour"]: row["count"] for row in store.hourly_counts(date, stats_exclude_classes(insects_only))}
+    return [{"hour": hour, "count": counts.get(hour, 0)} for hour in range(24)]
+
+
+@app.get("/stats/daily_by_class")
+def get_daily_stats_by_class(insects_only: bool = True, api_key: APIKey = Depends(auth.get_api_key)):
+    return store.daily_counts_by_class(stats_exclude_classes(insects_only))
+
+
+@app.get("/stats/heatmap")
+def get_heatmap_stats(insects_only: bool = True, api_key: APIKey = Depends(auth.get_api_key)):
+    return store.hourly_counts_by_class(stats_exclude_classes(insects_only))
+
+
+@app.get("/stats/duration")
+def get_duration_stats(insects_only: bool = True, api_key: APIKey = Depends(auth.get_api_key)):
+    # Number of tracking runs and mean duration_s per class, most frequent class first
+    return store.class_totals(stats_exclude_classes(insects_only))
+
+
 @app.get("/data/classification")
-def get_classification_data(api_key: APIKey = Depends(auth.get_api_key)):
-    data = pd.read_csv(CLASSIFICATION_DATA_PATH)
-    return data.to_dict(orient="records")
+def get_classification_data(
+    request: Request,
+    since: str | None = None,
+    api_key: APIKey = Depends(auth.get_api_key),
+):
+    # `since` is either a row id (only rows with a larger id) or a datetime (only runs that ended later).
+    # Send `Accept: application/vnd.apache.arrow.stream` or `application/vnd.apache.parquet` for a typed,
+    # columnar response instead of JSON.
+    media_type = negotiate_media_type(request)
+    last_id, last_modified = store.last_id, store.last_modified
+    etag = f"{last_id}-{media_type.split('/')[-1]}" + (f"-{since}" if since is not None else "")
+    etag = f'W/"{etag}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": format_datetime(last_modified, usegmt=True),
+        "Cache-Control": "no-cache",
+        "Vary": "Accept",
+    }
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    if since is None:
+        # The full history is served from memory until the next insert
+        cached_id, payload = classification_payload_cache.get(media_type, (None, b""))
+        if cached_id != last_id:
+            payload = serialize_classifications(store.all(), media_type)
+            classification_payload_cache[media_type] = (last_id, payload)
+    elif since.isdigit():
+        payload = serialize_classifications(store.since_id(int(since)), media_type)
+    else:
+        try:
+            since_time = datetime.fromisoformat(since)
+        except ValueError:
+            raise HTTPException(status_code=422, detail="since must be a row id or an ISO 8601 datetime")
+        payload = serialize_classifications(store.since_time(since_time), media_type)
+    return Response(payload, media_type=media_type, headers=headers)
+
 
 @app.get("/data/all")
-def get_all_data(background_tasks: BackgroundTasks, api_key: APIKey = Depends(auth.get_api_key)):
-    zip_archive_name = shutil.make_archive(f"waskrabbeltda_data_{datetime.today().strftime('%Y-%m-%d')}", 'zip', 'data')
-    background_tasks.add_task(remove_file, zip_archive_name)
-    return FileResponse(zip_archive_name)
+def get_all_data(api_key: APIKey = Depends(auth.get_api_key)):
+    # All images plus the classification data as CSV. The database files are not archived,
+    # they can change while the archive is streamed, nor is the migrated CSV, its rows are in the database.
+    exclude = {
+        "lost+found",
+        CLASSIFICATION_DB_PATH.name,
+        f"{CLASSIFICATION_DB_PATH.name}-wal",
+        f"{CLASSIFICATION_DB_PATH.name}-shm",
+        CLASSIFICATION_MIGRATED_PATH.name,
+    }
+    entries = itertools.chain(
+        directory_entries("data", exclude=exclude, hidden=False),  # not the caches and the job queue in data/.*
+        [(CLASSIFICATION_DATA_PATH.name, classification_csv())],
+    )
+    return zip_response(entries, f"waskrabbeltda_data_{datetime.today().strftime('%Y-%m-%d')}.zip")
+
+
+# Registered before /data/{date}/{tracking_run}, which would match this path as well
+@app.get("/data/most_recent/images")
+def get_most_recent_tracking_run_images(api_key: APIKey = Depends(auth.get_api_key)):
+    most_recent_date, most_recent_tracking_run = most_recent_run_or_404()
+    return tracking_run_archive_response(
+        tracking_run_path(most_recent_date, most_recent_tracking_run),
+        f"waskrabbeltda_data_{most_recent_date}_{most_recent_tracking_run}.zip",
+    )
+
 
 @app.get("/data/{date}/{tracking_run}")
-def get_tracking_run_images(date: str, tracking_run: str, background_tasks: BackgroundTasks, api_key: APIKey = Depends(auth.get_api_key)):
-    zip_archive_name = shutil.make_archive(f"waskrabbeltda_data_{date}_{tracking_run}", 'zip', Path("data", date, tracking_run))
-    background_tasks.add_task(remove_file, zip_archive_name)
-    return FileResponse(zip_archive_name)
+def get_tracking_run_images(date: str, tracking_run: str, api_key: APIKey = Depends(auth.get_api_key)):
+    return tracking_run_archive_response(
+        tracking_run_path(date, tracking_run),
+        f"waskrabbeltda_data_{date}_{tracking_run}.zip",
+    )
+
+
+@app.get("/data/{date}/{tracking_run}/images")
+def list_tracking_run_images(
+    date: str,
+    tracking_run: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(25, ge=0, le=500),
+    api_key: APIKey = Depends(auth.get_api_key),
+):
+    # One page of the image file names of a run in capture order, fetch them one by one from images/ or thumbnails/
+    images = run_images(tracking_run_path(date, tracking_run))
+    return {"total": len(images), "offset": offset, "limit": limit, "images": images[offset : offset + limit]}
+
+
+@app.get("/data/{date}/{tracking_run}/images/{filename}")
+def get_tracking_run_image(date: str, tracking_run: str, filename: str, api_key: APIKey = Depends(auth.get_api_key)):
+    return FileResponse(tracking_run_image_path(date, tracking_run, filename))
+
+
+@app.get("/data/{date}/{tracking_run}/thumbnails/{filename}")
+def get_tracking_run_thumbnail(
+    date: str,
+    tracking_run: str,
+    filename: str,
+    size: int | None = None,
+    fmt: str | None = Query(None, alias="format"),
+    api_key: APIKey = Depends(auth.get_api_key),
+):
+    return thumbnail_response(tracking_run_image_path(date, tracking_run, filename), size, fmt)
+
+
+@app.get("/data/{date}/{tracking_run}/snapshot")
+def get_tracking_run_snapshot(
+    date: str,
+    tracking_run: str,
+    size: int | None = None,
+    fmt: str | None = Query(None, alias="format"),
+    api_key: APIKey = Depends(auth.get_api_key),
+):
+    # Thumbnail of one representative image of the run, its file name is sent in the X-Image-Name header
+    filename = representative_image(tracking_run_path(date, tracking_run))
+    if filename is None:
+        raise HTTPException(status_code=404, detail="Tracking run has no images")
+    return thumbnail_response(tracking_run_image_path(date, tracking_run, filename), size, fmt)
 
 
 @app.get("/data/most_recent")
 def get_most_recent_tracking_run(api_key: APIKey = Depends(auth.get_api_key)):
-    data_path = Path("data")
-    date_folders = [
-        folder
-        for folder in os.listdir(data_path)
-        if os.path.isdir(Path(data_path, folder)) and folder != "lost+found"
-    ]
-    most_recent_date = sorted(date_folders)[-1]
-    most_recent_tracking_run = sorted(
-        os.listdir(Path(data_path, most_recent_date)),
-        key=lambda folder_name: folder_name[-8:],
-    )[-1]
+    most_recent_date, most_recent_tracking_run = most_recent_run_or_404()
     return {
         "most_recent_date": most_recent_date,
         "most_recent_tracking_run": most_recent_tracking_run,
@@ -138,32 +637,10 @@ def get_most_recent_tracking_run(api_key: APIKey = Depends(auth.get_api_key)):
 def get_most_recent_insect_tracking_run(
     api_key: APIKey = Depends(auth.get_api_key),
 ):
-    data_path = Path("data")
-    date_folders = [
-        folder
-        for folder in os.listdir(data_path)
-        if os.path.isdir(Path(data_path, folder)) and folder != "lost+found"
-    ]
-    most_recent_date = sorted(date_folders)[-1]
-    available_tracking_runs = os.listdir(Path(data_path, most_recent_date))
-    data = pd.read_csv(CLASSIFICATION_DATA_PATH)
-
-    insect_tracking_runs = list(
-        data[(data["date"] == most_recent_date) & (~data.top1.isin(EXCLUDE_CLASSES))][
-            "tracking_run_ID"
-        ]
-    )
-
-    if not insect_tracking_runs:
-        return {
-            "most_recent_date": most_recent_date,
-            "most_recent_tracking_run": None,
-        }
-
-    most_recent_tracking_run = sorted(
-        insect_tracking_runs,
-        key=lambda folder_name: folder_name[-8:],
-    )[-1]
+    most_recent_date = run_index.most_recent_date()
+    if most_recent_date is None:
+        raise HTTPException(status_code=404, detail="No tracking runs stored yet")
+    most_recent_tracking_run = store.most_recent_run(most_recent_date, EXCLUDE_CLASSES)
 
     return {
         "most_recent_date": most_recent_date,
@@ -176,50 +653,10 @@ def get_most_recent_insect_tracking_runs(
     api_key: APIKey = Depends(auth.get_api_key),
 ):
     insect_count = 10  # TODO: make this a parameter
-    data = pd.read_csv(CLASSIFICATION_DATA_PATH)
-    data = data[~data.top1.isin(EXCLUDE_CLASSES)]
-    data = data.sort_values("end_time", ascending=False)
-    data = data.head(int(insect_count))
-    response = [
-        {"date": row["date"], "tracking_run_ID": row["tracking_run_ID"]}
-        for _, row in data.iterrows()
-    ]
-    return response
-
-
-@app.get("/data/most_recent/images")
-def get_most_recent_tracking_run_images(
-    background_tasks: BackgroundTasks, api_key: APIKey = Depends(auth.get_api_key)
-):
-    data_path = Path("data")
-    date_folders = [
-        folder
-        for folder in os.listdir(data_path)
-        if os.path.isdir(Path(data_path, folder)) and folder != "lost+found"
-    ]
-    most_recent_date = sorted(date_folders)[-1]
-    most_recent_tracking_run = sorted(
-        os.listdir(Path(data_path, most_recent_date)),
-        key=lambda folder_name: folder_name[-8:],
-    )[-1]
-    zip_archive_name = shutil.make_archive(
-        f"waskrabbeltda_data_{most_recent_date}_{most_recent_tracking_run}",
-        "zip",
-        Path("data", most_recent_date, most_recent_tracking_run),
-    )
-    background_tasks.add_task(remove_file, zip_archive_name)
-    return FileResponse(zip_archive_name)
+    return store.most_recent_runs(insect_count, EXCLUDE_CLASSES)
 
 
 @app.get("/data/tracking_runs")
-def get_tracking_runs(api_key: APIKey = Depends(auth.get_api_key)):
-    tracking_runs = {}
-    # iterate over each date folder in data
-    data_path = Path("data")
-    for folder in os.listdir(data_path):
-        if not os.path.isdir(Path(data_path, folder)) or folder == "lost+found":
-            continue
-        tracking_runs[folder] = []
-        for tracking_run in os.listdir(Path(data_path,folder)):
-            tracking_runs[folder].append(tracking_run)
-    return tracking_runs
+def get_tracking_runs(details: bool = False, api_key: APIKey = Depends(auth.get_api_key)):
+    # Tracking runs per date ordered by end time, with `details` including their number of images and bytes
+    return run_index.details() if details else run_index.runs()
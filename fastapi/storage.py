@@ -0,0 +1,248 @@
+import csv
+import sqlite3
+import sys
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+COLUMNS = [
+    "date",
+    "start_time",
+    "end_time",
+    "duration_s",
+    "track_ID",
+    "track_ID_imgs",
+    "tracking_run_ID",
+    "top1",
+    "top1_prob",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS classifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT NOT NULL,
+    start_time TEXT,
+    end_time TEXT,
+    duration_s INTEGER,
+    track_ID INTEGER,
+    track_ID_imgs INTEGER,
+    tracking_run_ID TEXT,
+    top1 TEXT,
+    top1_prob REAL
+);
+CREATE INDEX IF NOT EXISTS idx_classifications_date ON classifications (date);
+CREATE INDEX IF NOT EXISTS idx_classifications_end_time ON classifications (end_time);
+CREATE INDEX IF NOT EXISTS idx_classifications_top1 ON classifications (top1);
+CREATE INDEX IF NOT EXISTS idx_classifications_tracking_run_ID ON classifications (tracking_run_ID);
+
+-- Materialized rollup for the dashboard statistics, updated with every insert
+CREATE TABLE IF NOT EXISTS stats_rollup (
+    date TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    top1 TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    duration_s_sum INTEGER NOT NULL,
+    PRIMARY KEY (date, hour, top1)
+);
+"""
+
+# Hour of the start time: 'YYYY-MM-DD HH:MM:SS' -> HH, -1 if unknown
+ROLLUP_SELECT = """
+SELECT date, COALESCE(CAST(substr(start_time, 12, 2) AS INTEGER), -1), COALESCE(top1, ''), 1, COALESCE(duration_s, 0)
+FROM classifications
+"""
+ROLLUP_UPSERT = """
+ON CONFLICT (date, hour, top1) DO UPDATE SET
+    count = count + excluded.count,
+    duration_s_sum = duration_s_sum + excluded.duration_s_sum
+"""
+
+
+class ClassificationStore:
+    """SQLite storage for the classification results of all tracking runs.
+
+    The database runs in WAL mode, so readers never block the writer and an insert
+    is a single append instead of rewriting the whole history. Every thread uses
+    its own connection. `last_id` and `last_modified` change with every insert and
+    can be used to validate cached responses.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as con:
+            con.executescript(SCHEMA)
+            if not con.execute("SELECT 1 FROM stats_rollup LIMIT 1").fetchone():
+                # Backfill the rollup, i.e. for databases created before it existed
+                con.execute(f"INSERT INTO stats_rollup {ROLLUP_SELECT} WHERE true {ROLLUP_UPSERT}")
+        self.last_id = self._connection().execute("SELECT COALESCE(MAX(id), 0) FROM classifications").fetchone()[0]
+        self.last_modified = datetime.fromtimestamp(self.path.stat().st_mtime, timezone.utc)
+
+    def _connection(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=30)
+            con.row_factory = sqlite3.Row
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints, safe against corruption in WAL mode
+            self._local.con = con
+        return con
+
+    def insert(self, row):
+        return self.insert_many([row])
+
+    def insert_many(self, rows):
+        # Append rows (dicts with the keys in COLUMNS) in one transaction, returns the id of the last row
+        values = [tuple(_to_sql(row.get(column)) for column in COLUMNS) for row in rows]
+        sql = f"INSERT INTO classifications ({', '.join(COLUMNS)}) VALUES ({_placeholders(COLUMNS)})"
+        with self._connection() as con:
+            row_id = None
+            for value in values:
+                row_id = con.execute(sql, value).lastrowid
+                con.execute(f"INSERT INTO stats_rollup {ROLLUP_SELECT} WHERE id = ? {ROLLUP_UPSERT}", (row_id,))
+        self._inserted(row_id)
+        return row_id
+
+    def insert_run(self, row):
+        # Insert the row of a tracking run unless a row of the same date and tracking_run_ID exists, so storing
+        # a run again (i.e. a job interrupted by a restart) doesn't duplicate it. Returns the id of the new row,
+        # None if the run was stored already
+        sql = (
+            f"INSERT INTO classifications ({', '.join(COLUMNS)}) SELECT {_placeholders(COLUMNS)} "
+            "WHERE NOT EXISTS (SELECT 1 FROM classifications WHERE date = ? AND tracking_run_ID = ?)"
+        )
+        value = tuple(_to_sql(row.get(column)) for column in COLUMNS)
+        with self._connection() as con:
+            cursor = con.execute(sql, (*value, _to_sql(row.get("date")), _to_sql(row.get("tracking_run_ID"))))
+            if not cursor.rowcount:
+                return None
+            row_id = cursor.lastrowid
+            con.execute(f"INSERT INTO stats_rollup {ROLLUP_SELECT} WHERE id = ? {ROLLUP_UPSERT}", (row_id,))
+        self._inserted(row_id)
+        return row_id
+
+    def _inserted(self, row_id):
+        if row_id is not None:
+            self.last_id = max(self.last_id, row_id)
+            self.last_modified = datetime.now(timezone.utc)
+
+    def count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM classifications").fetchone()[0]
+
+    def all(self):
+        return self._query(f"SELECT id, {', '.join(COLUMNS)} FROM classifications ORDER BY id")
+
+    def since_id(self, row_id):
+        # Rows inserted after the row with the given id
+        return self._query(f"SELECT id, {', '.join(COLUMNS)} FROM classifications WHERE id > ? ORDER BY id", (row_id,))
+
+    def since_time(self, end_time):
+        # Rows of tracking runs that ended after the given datetime
+        return self._query(
+            f"SELECT id, {', '.join(COLUMNS)} FROM classifications WHERE end_time > ? ORDER BY id", (_to_sql(end_time),)
+        )
+
+    def most_recent_run(self, date, exclude_classes=()):
+        # Tracking run of the given date with the latest end time in its name, i.e. 'ID3-12-00-03'
+        rows = self._query(
+            f"SELECT tracking_run_ID FROM classifications WHERE date = ? AND top1 NOT IN ({_placeholders(exclude_classes)}) "
+            "ORDER BY substr(tracking_run_ID, -8) DESC LIMIT 1",
+            (date, *exclude_classes),
+        )
+        return rows[0]["tracking_run_ID"] if rows else None
+
+    def most_recent_runs(self, limit, exclude_classes=()):
+        return self._query(
+            f"SELECT date, tracking_run_ID FROM classifications WHERE top1 NOT IN ({_placeholders(exclude_classes)}) "
+            "ORDER BY end_time DESC LIMIT ?",
+            (*exclude_classes, limit),
+        )
+
+    def hourly_counts(self, date, exclude_classes=()):
+        # Number of tracking runs per start hour of the given date
+        return self._query(
+            f"SELECT hour, SUM(count) AS count FROM stats_rollup WHERE date = ? AND hour >= 0 AND top1 NOT IN ({_placeholders(exclude_classes)}) "
+            "GROUP BY hour ORDER BY hour",
+            (date, *exclude_classes),
+        )
+
+    def daily_counts_by_class(self, exclude_classes=()):
+        return self._query(
+            f"SELECT date, top1, SUM(count) AS count FROM stats_rollup WHERE top1 NOT IN ({_placeholders(exclude_classes)}) "
+            "GROUP BY date, top1 ORDER BY date, top1",
+            tuple(exclude_classes),
+        )
+
+    def hourly_counts_by_class(self, exclude_classes=()):
+        return self._query(
+            f"SELECT top1, hour, SUM(count) AS count FROM stats_rollup WHERE hour >= 0 AND top1 NOT IN ({_placeholders(exclude_classes)}) "
+            "GROUP BY top1, hour ORDER BY top1, hour",
+            tuple(exclude_classes),
+        )
+
+    def class_totals(self, exclude_classes=()):
+        # Number of tracking runs and mean duration per class
+        return self._query(
+            "SELECT top1, SUM(count) AS count, CAST(SUM(duration_s_sum) AS REAL) / SUM(count) AS mean_duration_s "
+            f"FROM stats_rollup WHERE top1 NOT IN ({_placeholders(exclude_classes)}) GROUP BY top1 ORDER BY count DESC",
+            tuple(exclude_classes),
+        )
+
+    def _query(self, sql, parameters=()):
+        return [dict(row) for row in self._connection().execute(sql, parameters)]
+
+
+def _placeholders(values):
+    return ", ".join("?" * len(values))
+
+
+def _to_sql(value):
+    # Store dates and datetimes in the same string format as the former CSV file
+    return value if value is None or isinstance(value, (int, float, str)) else str(value)
+
+
+def to_arrow(rows):
+    # Convert rows to a typed pyarrow.Table: timestamps for start_time/end_time (wall clock time of the
+    # camera, like the stored strings) and a dictionary encoded (categorical) top1 column
+    import pyarrow as pa  # only needed for the Arrow/Parquet responses
+
+    def column(name):
+        return [row[name] for row in rows]
+
+    return pa.table(
+        {
+            "id": pa.array(column("id"), pa.int64()),
+            "date": pa.array(column("date"), pa.string()),
+            "start_time": pa.array([_parse_datetime(v) for v in column("start_time")], pa.timestamp("us")),
+            "end_time": pa.array([_parse_datetime(v) for v in column("end_time")], pa.timestamp("us")),
+            "duration_s": pa.array(column("duration_s"), pa.int64()),
+            "track_ID": pa.array(column("track_ID"), pa.int64()),
+            "track_ID_imgs": pa.array(column("track_ID_imgs"), pa.int64()),
+            "tracking_run_ID": pa.array(column("tracking_run_ID"), pa.string()),
+            "top1": pa.array(column("top1"), pa.string()).dictionary_encode(),
+            "top1_prob": pa.array(column("top1_prob"), pa.float64()),
+        }
+    )
+
+
+def _parse_datetime(value):
+    try:
+        return datetime.fromisoformat(value).replace(tzinfo=None)
+    except (TypeError, ValueError):
+        return None
+
+
+def migrate_csv(csv_path, store):
+    # One-shot import of the former classification_data.csv, returns the number of imported rows
+    with open(csv_path, newline="") as f:
+        rows = [{k: (v if v != "" else None) for k, v in row.items()} for row in csv.DictReader(f)]
+    if rows:
+        store.insert_many(rows)
+    return len(rows)
+
+
+if __name__ == "__main__":
+    # Usage: python storage.py data/classification_data.csv data/classification_data.db
+    csv_path, db_path = sys.argv[1:3]
+    print(f"Imported {migrate_csv(csv_path, ClassificationStore(db_path))} rows from {csv_path} into {db_path}")
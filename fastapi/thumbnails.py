@@ -0,0 +1,149 @@
+import os
+import threading
+import uuid
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+FORMATS = {
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+}
+
+
+def run_images(run_path):
+    # Image file names of a tracking run in capture order, the names start with the capture timestamp
+    with os.scandir(run_path) as it:
+        return sorted(
+            entry.name for entry in it if entry.is_file() and Path(entry.name).suffix.lower() in IMAGE_SUFFIXES
+        )
+
+
+def representative_image(run_path):
+    # Crop from the middle of the track, the insect is usually fully in view there
+    images = run_images(run_path)
+    return images[len(images) // 2] if images else None
+
+
+class ThumbnailCache:
+    """Downscaled renditions of the tracking run images, cached on disk.
+
+    Thumbnails fit into a square of one of the configured `sizes` (in pixels, the
+    aspect ratio is kept and images are never upscaled) and are encoded as WebP or
+    JPEG. The thumbnails of the default format are generated when a run is
+    classified, others on first request. A thumbnail is regenerated when its
+    source image is newer. Serving a thumbnail marks it as recently used. When the
+    cache grows beyond `max_bytes`, the least recently used thumbnails are deleted.
+    """
+
+    def __init__(self, cache_dir, max_bytes, sizes=(128, 256), default_format="webp", quality=80):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.sizes = sorted(sizes)
+        self.default_format = default_format
+        self.quality = quality
+        self._lock = threading.Lock()  # serializes eviction
+        self._bytes = None  # estimated size of the cache, None until it is scanned
+
+    def nearest_size(self, size):
+        # Smallest configured size that is at least size, the largest one for larger sizes
+        return next((s for s in self.sizes if s >= size), self.sizes[-1])
+
+    def path(self, image_path, size, fmt=None):
+        image_path = Path(image_path)
+        suffix = FORMATS[fmt or self.default_format][0]
+        date, run = image_path.parent.parent.name, image_path.parent.name
+        # Keyed on the full file name, i.e. a.jpg -> a.jpg.webp, so a.jpg and a.png of a run don't share a thumbnail
+        return Path(self.cache_dir, date, run, str(size), image_path.name + suffix)
+
+    def get_or_build(self, image_path, size, fmt=None):
+        path = self.path(image_path, size, fmt)
+        try:
+            if path.stat().st_mtime_ns >= os.stat(image_path).st_mtime_ns:
+                os.utime(path)  # mark as recently used
+                return path
+        except FileNotFoundError:
+            pass
+        with open(image_path, "rb") as f:
+            content = f.read()
+        self._added(self._write(path, self.render(content, size, fmt)))
+        return path
+
+    def build(self, run_path, images=None):
+        # Thumbnails of all sizes for a run, from the (name, bytes) of the uploaded images if given
+        run_path = Path(run_path)
+        if images is None:
+            images = [(name, Path(run_path, name).read_bytes()) for name in run_images(run_path)]
+        written = 0
+        for name, content in images:
+            if Path(name).suffix.lower() not in IMAGE_SUFFIXES:
+                continue
+            im = _decode(content)
+            if im is None:
+                continue
+            for size in self.sizes:
+                written += self._write(self.path(Path(run_path, name), size), self._encode(_resize(im, size), None))
+        self._added(written)
+
+    def render(self, content, size, fmt=None):
+        im = _decode(content)
+        if im is None:
+            raise ValueError("Image could not be decoded")
+        return self._encode(_resize(im, size), fmt)
+
+    def _encode(self, im, fmt):
+        suffix, _, quality_flag = FORMATS[fmt or self.default_format]
+        ok, buffer = cv2.imencode(suffix, im, [quality_flag, self.quality])
+        if not ok:
+            raise ValueError(f"Encoding {suffix} failed")
+        return buffer.tobytes()
+
+    def _added(self, size):
+        # Count written bytes and enforce the disk budget. The running total is only an estimate
+        # (replaced thumbnails are counted twice), the cache is scanned once it exceeds the budget.
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += size
+            if self._bytes is None or self._bytes > self.max_bytes:
+                self._bytes = self._evict()
+
+    def _evict(self):
+        # Delete the least recently used thumbnails above max_bytes, returns the size of the cache
+        thumbnails = []
+        for path in self.cache_dir.rglob("*"):
+            if path.name.startswith(".") or not path.is_file():  # being written, or a directory
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            thumbnails.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in thumbnails)
+        for _, size, path in sorted(thumbnails):  # least recently used first
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+        return total
+
+    @staticmethod
+    def _write(path, content):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, path)
+        return len(content)
+
+
+def _decode(content):
+    return cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_COLOR)
+
+
+def _resize(im, size):
+    h, w = im.shape[:2]
+    scale = size / max(h, w)
+    if scale >= 1:
+        return im
+    return cv2.resize(im, (max(round(w * scale), 1), max(round(h * scale), 1)), interpolation=cv2.INTER_AREA)
@@ -0,0 +1,174 @@
+import bisect
+import os
+import threading
+from pathlib import Path
+
+from log import LOGGER
+
+
+class TrackingRunIndex:
+    """In-memory index of the tracking runs stored in the data directory.
+
+    Maps dates to their tracking runs, ordered by the end time in the run name
+    (i.e. 'ID3-12-00-03'), together with the number of images and bytes of every
+    run. The index is built by one scan at startup and updated by the classify
+    endpoint. A background thread rescans the data directory every
+    `reconcile_interval_s` seconds to pick up changes made outside of the API,
+    e.g. deleted runs. A rescan only counts the files of runs whose directory
+    modification time changed since the last scan, and runs updated by the API
+    while a rescan is in progress keep their updated counts.
+    """
+
+    def __init__(self, data_path, reconcile_interval_s=60):
+        self.data_path = Path(data_path)
+        self.reconcile_interval_s = reconcile_interval_s
+        self._dates = []  # sorted date folder names
+        self._runs = {}  # date -> [(end time, run)] sorted by end time
+        self._info = {}  # (date, run) -> {"images": n, "bytes": n}
+        self._mtimes = {}  # (date, run) -> modification time of the run directory when it was counted
+        self._updated = set()  # (date, run) updated since the current rescan started
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.rebuild()
+        if self._thread is None and self.reconcile_interval_s > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._reconcile, name="tracking-run-index", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def rebuild(self):
+        # Scan of the data directory, replaces the index at once
+        with self._lock:
+            self._updated = set()
+            known_info, known_mtimes = dict(self._info), dict(self._mtimes)
+        dates, runs, info, mtimes = [], {}, {}, {}
+        for date, _ in _subdirectories(self.data_path):
+            if date == "lost+found" or date.startswith("."):
+                continue
+            dates.append(date)
+            runs[date] = []
+            for run, mtime in _subdirectories(Path(self.data_path, date)):
+                if run.startswith("."):
+                    continue
+                key = (date, run)
+                runs[date].append((_end_time(run), run))
+                mtimes[key] = mtime
+                # Files added, removed or renamed change the directory modification time
+                unchanged = key in known_info and known_mtimes.get(key) == mtime
+                info[key] = known_info[key] if unchanged else _run_info(Path(self.data_path, date, run))
+            runs[date].sort()
+        dates.sort()
+        with self._lock:
+            # The scan may have missed or half counted runs that were stored meanwhile, keep their update
+            for key in self._updated:
+                date, run = key
+                if date not in runs:
+                    bisect.insort(dates, date)
+                    runs[date] = []
+                if key not in info:
+                    bisect.insort(runs[date], (_end_time(run), run))
+                info[key], mtimes[key] = self._info[key], self._mtimes[key]
+            self._dates, self._runs, self._info, self._mtimes = dates, runs, info, mtimes
+
+    def update(self, run_path):
+        # Add or refresh the tracking run in data/<date>/<run> after files have been stored
+        run_path = Path(run_path)
+        date, run = run_path.parent.name, run_path.name
+        mtime = _mtime(run_path)
+        info = _run_info(run_path)
+        with self._lock:
+            if date not in self._runs:
+                bisect.insort(self._dates, date)
+                self._runs[date] = []
+            if (date, run) not in self._info:
+                bisect.insort(self._runs[date], (_end_time(run), run))
+            self._info[(date, run)] = info
+            self._mtimes[(date, run)] = mtime
+            self._updated.add((date, run))
+
+    def most_recent_date(self):
+        with self._lock:
+            return self._dates[-1] if self._dates else None
+
+    def most_recent_run(self):
+        # (date, run) of the latest tracking run of the most recent date, or (None, None)
+        with self._lock:
+            for date in reversed(self._dates):
+                if self._runs[date]:
+                    return date, self._runs[date][-1][1]
+        return None, None
+
+    def runs(self, date=None):
+        # Runs of one date ordered by end time, or of all dates as {date: [runs]}
+        with self._lock:
+            if date is not None:
+                return [run for _, run in self._runs.get(date, [])]
+            return {date: [run for _, run in self._runs[date]] for date in self._dates}
+
+    def details(self):
+        # {date: [{"tracking_run": run, "images": n, "bytes": n}]} of all runs ordered by end time
+        with self._lock:
+            return {
+                date: [{"tracking_run": run, **self._info[(date, run)]} for _, run in self._runs[date]]
+                for date in self._dates
+            }
+
+    def info(self, date, run):
+        with self._lock:
+            return self._info.get((date, run))
+
+    def _reconcile(self):
+        while not self._stop.wait(self.reconcile_interval_s):
+            try:
+                self.rebuild()
+            except Exception:
+                LOGGER.exception("Rescanning the tracking runs failed")
+
+
+def _subdirectories(path):
+    # [(name, modification time)] of the directories in path
+    directories = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        directories.append((entry.name, entry.stat().st_mtime_ns))
+                except FileNotFoundError:  # deleted meanwhile
+                    pass
+    except FileNotFoundError:
+        pass
+    return directories
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _end_time(run):
+    # Sort key of a tracking run: its end time, the last 8 characters of the name
+    return run[-8:]
+
+
+def _run_info(run_path):
+    images = size = 0
+    try:
+        with os.scandir(run_path) as it:
+            for entry in it:
+                if entry.is_file():
+                    images += 1
+                    size += entry.stat().st_size
+    except FileNotFoundError:
+        pass
+    return {"images": images, "bytes": size}
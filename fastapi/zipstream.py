@@ -0,0 +1,86 @@
+import io
+import os
+import time
+import zipfile
+from pathlib import Path
+
+CHUNK_SIZE = 256 * 1024
+# Formats that are compressed already, deflating them costs CPU for (almost) no gain
+STORED_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".zip", ".gz", ".parquet"}
+
+
+class _ChunkSink(io.RawIOBase):
+    # Non-seekable file object that collects what zipfile writes until it is popped
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._position
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(entries, chunk_size=CHUNK_SIZE):
+    """Generate a zip archive chunk by chunk, without a temporary file.
+
+    `entries` is an iterable of (arcname, source) pairs, where source is either a
+    path to a file on disk or an iterable of bytes. Memory usage is bounded by
+    `chunk_size`, independent of the archive size. JPEGs and other compressed
+    formats are stored, everything else is deflated.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", allowZip64=True) as archive:
+        for arcname, source in entries:
+            if isinstance(source, (str, Path)):
+                info = zipfile.ZipInfo.from_file(source, arcname)
+                chunks = _read_chunks(source, chunk_size)
+            else:
+                info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+                info.external_attr = 0o644 << 16
+                chunks = source
+            stored = Path(arcname).suffix.lower() in STORED_SUFFIXES
+            info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+            with archive.open(info, "w") as dst:
+                for chunk in chunks:
+                    dst.write(chunk)
+                    if data := sink.pop():
+                        yield data
+            if data := sink.pop():
+                yield data
+    yield sink.pop()  # central directory
+
+
+def _read_chunks(path, chunk_size):
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def directory_entries(directory, prefix="", exclude=(), hidden=True):
+    # (arcname, path) pairs of all files below directory in sorted order, skipping top level names in exclude
+    # and, with hidden=False, names starting with a dot. The tree is listed lazily one directory at a time and
+    # skipped directories are not entered, so streaming starts right away
+    directory = Path(directory)
+    with os.scandir(directory) as it:
+        entries = sorted(
+            (entry for entry in it if entry.name not in exclude and (hidden or not entry.name.startswith("."))),
+            key=lambda entry: entry.name,
+        )
+    for entry in entries:
+        if entry.is_dir():
+            yield from directory_entries(entry.path, Path(prefix, entry.name), hidden=hidden)
+        elif entry.is_file():
+            yield str(Path(prefix, entry.name)), Path(entry.path)
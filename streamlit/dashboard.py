@@ -1,41 +1,19 @@
-import io
-import zipfile
 import streamlit as st
 import pandas as pd
 import numpy as np
 import altair as alt
 import math
-from pathlib import Path
 import os
 import datetime
 import json
 import locale
-import random
 import matplotlib.pyplot as plt  # für Kreisdiagramme
 from PIL import Image  # für das Logo
-import requests
 from dotenv import load_dotenv
 
-load_dotenv()
-
-CLASSIFICATION_DATA_ENDPOINT = (
-    f"{os.getenv('DATA_ENDPOINT', 'http://fastapi:8000')}/data/classification"
-)
-DATA_ALL_ENDPOINT = f"{os.getenv('DATA_ENDPOINT', 'http://fastapi:8000')}/data/all"
-TRACKING_RUNS_ENDPOINT = (
-    f"{os.getenv('DATA_ENDPOINT', 'http://fastapi:8000')}/data/tracking_runs"
-)
-MOST_RECENT_INSECTS_ENDPOINT = (
-    f"{os.getenv('DATA_ENDPOINT', 'http://fastapi:8000')}/data/most_recent_insects"
-)
-
-MOST_RECENT_INSECT_ENDPOINT = (
-    f"{os.getenv('DATA_ENDPOINT', 'http://fastapi:8000')}/data/most_recent_insect"
-)
+import data_access
 
-IMAGE_ENDPOINT = f"{os.getenv('DATA_ENDPOINT', 'http://fastapi:8000')}/data"
-
-API_KEY = os.getenv("API_KEY")
+load_dotenv()
 # CAMERA_NAME = os.getenv("CAMERA_NAME", "waskrabbeltda")
 
 
@@ -177,33 +155,14 @@ def get_latest_unique_snapshots(directory, num_snapshots=5):
     return snapshots
 
 
-def load_images(tracking_runs: list):
-    for run in tracking_runs:
-        date = run["date"]
-        run_id = run["tracking_run_ID"]
-
-        images_path = Path("data", date, run_id)
-
-        if not images_path.exists():
-            images_path.mkdir(parents=True)
-            # get zip file with all images for selected run
-            images_endpoint = f"{IMAGE_ENDPOINT}/{date}/{run_id}"
-            zip_images_response = requests.get(
-                images_endpoint, headers={"access_token": API_KEY}
-            )
-            zip_images = zipfile.ZipFile(io.BytesIO(zip_images_response.content))
-            zip_images.extractall(images_path)
-
-
-def get_unique_snapshots(tracking_run_list):
+# Thumbnail of one representative image per tracking run, a few KB each instead of the zip of the run
+def get_unique_snapshots(tracking_run_list, size=data_access.THUMBNAIL_SIZE):
     snapshots = []
 
     for run in tracking_run_list:
-        images_path = Path("data", run["date"], run["tracking_run_ID"])
-        run_files = os.listdir(images_path)
-        # select random run file
-        rand_index = random.randint(0, len(run_files) - 1)
-        snapshots.append(Path(images_path, run_files[rand_index]))
+        snapshot = data_access.load_snapshot(run["date"], run["tracking_run_ID"], size)
+        if snapshot is not None:
+            snapshots.append((run["tracking_run_ID"], snapshot))
     return snapshots
 
 
@@ -225,19 +184,31 @@ def make_pie_chart(data):
     st.pyplot(fig)
 
 
+# Load pre-aggregated statistics of insect observations from the backend.
+# Labels are translated to German, classes with the same translation are summed up.
+def load_stats(name, columns, **params):
+    stats = pd.DataFrame.from_records(
+        data_access.load_stats(name, **params), columns=columns
+    )
+    if "top1" in columns:
+        stats["top1"] = stats["top1"].map(translate_label)
+        keys = [column for column in columns if column not in ("count", "mean_duration_s")]
+        if "mean_duration_s" in columns:
+            stats["duration_s_sum"] = stats["mean_duration_s"] * stats["count"]
+        stats = stats.groupby(keys, as_index=False, sort=False).sum()
+        if "mean_duration_s" in columns:
+            stats["mean_duration_s"] = stats["duration_s_sum"] / stats["count"]
+            stats = stats.drop(columns="duration_s_sum")
+    return stats
+
+
 # Load data with caching, column renaming and data type conversions.
 # Create additionally needed data columns here.
-# @st.cache_data
 def load_data():
-    response = requests.get(
-        CLASSIFICATION_DATA_ENDPOINT, headers={"access_token": API_KEY}
-    )
-    data = response.json()
-    data = pd.DataFrame(data)
+    # Cached copy of the classification data, refreshed incrementally in the background
+    data = data_access.load_classifications()
     lowercase = lambda x: str(x).lower()
     data.rename(lowercase, axis="columns", inplace=True)
-    data[START_TIME_COLUMN] = pd.to_datetime(data[START_TIME_COLUMN])
-    data[END_TIME_COLUMN] = pd.to_datetime(data[END_TIME_COLUMN])
     data["hour"] = data[START_TIME_COLUMN].dt.hour
     # Remove observations which are not classified as insects
     dirt_data = data.copy()
@@ -291,6 +262,7 @@ def make_heatmap(input_df, input_y, input_x, input_color, input_color_theme):
 
 # Load data
 data, dirt_data = load_data()
+class_totals = load_stats("duration", ["top1", "count", "mean_duration_s"])
 
 # Dashboard content
 
@@ -343,7 +315,7 @@ with tab1:
             "%-d. %B %Y"
         )
         st.subheader("Überblick")
-        total_counts = len(data)
+        total_counts = int(class_totals["count"].sum())
         total_counts_today = len(df_selected_day)
         st.markdown("**Kameraname**: " + CAMERA_NAME)
         st.markdown("**Kamerastandort**: " + CAMERA_POSITION)
@@ -434,11 +406,7 @@ with tab1:
         st.markdown(
             "Wir fotografieren unsere krabbelnden Stars von oben. So können wir sie am besten erkennen. Unser roter Teppich ist grün: eine Acrylglasplatte bedruckt mit bunten Punkten. So sehen Bilder der letzten Krabbler aus. Übrigens: Die Kamera macht von jedem Krabbler viele Bilder. Sie bestimmt die Krabbler an Farbe, Form und Größe. **Erkennst du, wer da krabbelt?**"
         )
-        last_insect_tracking_runs = requests.get(
-            MOST_RECENT_INSECTS_ENDPOINT, headers={"access_token": API_KEY}
-        ).json()
-
-        load_images(last_insect_tracking_runs)
+        last_insect_tracking_runs = data_access.most_recent_insects()
 
         # Erhalte die letzten fünf Schnappschüsse mit unterschiedlichen IDs
         last_insect_snapshots = get_unique_snapshots(last_insect_tracking_runs)
@@ -447,14 +415,12 @@ with tab1:
             5
         )  # Ändere diese Zahl, um die Anzahl der Spalten anzupassen
         snapshot_col = 0
-        for image_path in last_insect_snapshots:
+        for tracking_run_id, snapshot in last_insect_snapshots:
             # insect_key = image.split("_")[1]  # Extrahiere den Schlüssel aus dem Dateinamen
             # insect_name = translate_label(insect_key)
-            image_path_str = str(image_path)
-            tracking_run_id = image_path_str.split("/")[2]
             with snapshots_grid[snapshot_col]:
                 st.image(
-                    image_path_str,
+                    snapshot,
                     caption=f"{tracking_run_id}, Label: {get_label(tracking_run_id, dirt_data)}, {get_prob(tracking_run_id, dirt_data) * 100:.2f}%",
                     use_column_width=True,
                 )
@@ -467,18 +433,8 @@ with tab1:
             "Je nachdem, wie der Tag verläuft, ist auch vor unserer Linse unterschiedlich viel los: An warmen Sommertagen ist mehr los als an kühlen. Wenn es regnet, besuchen weniger Krabbler unsere Kamera. Und auch wenn es stürmt, bleiben viele Fluginsekten lieber an geschützten Orten. Hier siehst du die **Anzahl der Insekten pro Stunde**."
         )
 
-        # Histogramm-Werte vorbereiten
-        hist_values = (
-            df_selected_day[START_TIME_COLUMN]
-            .dt.hour.value_counts()
-            .sort_index()
-            .reset_index()
-        )
-        hist_values.columns = ["hour", "count"]
-
-        # Sicherstellen, dass alle Stunden von 0 bis 23 enthalten sind
-        all_hours = pd.DataFrame({"hour": range(24)})
-        hist_values = all_hours.merge(hist_values, on="hour", how="left").fillna(0)
+        # Histogramm-Werte vom Server, alle Stunden von 0 bis 23 sind enthalten
+        hist_values = load_stats("hourly", ["hour", "count"], date=selected_date)
 
         # Bar-Chart mit Altair erstellen
         bar_chart = (
@@ -549,19 +505,13 @@ with tab1:
         )
         # get most recent snapshots
 
-        most_recent_directory_response = requests.get(
-            MOST_RECENT_INSECT_ENDPOINT, headers={"access_token": API_KEY}
-        ).json()
+        most_recent_directory_response = data_access.most_recent_insect()
 
         most_recent_date = most_recent_directory_response["most_recent_date"]
         most_recent_tracking_run = most_recent_directory_response[
             "most_recent_tracking_run"
         ]
-        most_recent_tracking_run_path = Path(
-            "data", most_recent_date, most_recent_tracking_run
-        )
-
-        files = os.listdir(most_recent_tracking_run_path)
+        image_count = data_access.list_images(most_recent_date, most_recent_tracking_run)["total"]
 
         # obtain label if available
         label = ""
@@ -578,7 +528,7 @@ with tab1:
             batch_size = st.select_slider("Batch size:", range(10, 30, 5), value=10)
         with controls[1]:
             row_size = st.select_slider("Row size:", range(1, 6), value=5)
-        num_batches = math.ceil(len(files) / batch_size)
+        num_batches = max(math.ceil(image_count / batch_size), 1)
         with controls[2]:
             page = st.selectbox("Seite", range(1, num_batches + 1))
         with controls[3]:
@@ -587,14 +537,22 @@ with tab1:
             else:
                 st.write("No classification data available for this run.")
 
-        batch = files[(page - 1) * batch_size : page * batch_size]
+        # Only the images of the visible page are transferred
+        batch = data_access.list_images(
+            most_recent_date,
+            most_recent_tracking_run,
+            offset=(page - 1) * batch_size,
+            limit=batch_size,
+        )["images"]
 
         grid = st.columns(row_size)
         col = 0
-        for image in batch:
+        for image, thumbnail in data_access.load_thumbnails(
+            most_recent_date, most_recent_tracking_run, batch
+        ):
             with grid[col]:
                 st.image(
-                    f"{most_recent_tracking_run_path}/{image}",
+                    thumbnail,
                     caption="Schnappschuss "
                     + image.split("_")[2]
                     + " Label: "
@@ -613,23 +571,19 @@ with tab2:
         "Die Linien zeigen, wie sich die Zahl der Insekten an den einzelnen Tagen verändert. Das kann viele Gründe haben: Entweder die Bedingungen waren für Schmetterlinge oder Honigbienen an einem Tag besser als am anderen. Oder sie haben zufälligerweise unsere Kamera gemieden. **Du kannst die einzelnen Krabbler-Klassen zuwählen oder ausblenden.**"
     )
     # Erstellen einer Liste der verfügbaren Arten
-    available_species = data["top1"].unique()
+    available_species = class_totals["top1"].unique()
     selected_species = st.multiselect(
         "Wähle Arten aus", available_species, default=available_species[:5]
     )
 
-    # Filtere die Daten nach den ausgewählten Arten
-    filtered_time_data = data[data["top1"].isin(selected_species)]
+    # Tägliche Anzahl pro Art vom Server, gefiltert nach den ausgewählten Arten
+    daily_counts = load_stats("daily_by_class", ["date", "top1", "count"])
+    time_series_data = daily_counts[daily_counts["top1"].isin(selected_species)]
 
-    if filtered_time_data.empty:
+    if time_series_data.empty:
         st.write("Keine Daten für die ausgewählten Arten")
     else:
-        # Gruppieren und Aggregieren der Daten
-        time_series_data = (
-            filtered_time_data.groupby(["date", "top1"])
-            .size()
-            .reset_index(name="count")
-        )
+        time_series_data = time_series_data.copy()
 
         # Formatieren des Datums in deutscher Schreibweise
         time_series_data["date"] = pd.to_datetime(time_series_data["date"]).dt.strftime(
@@ -667,11 +621,8 @@ with tab2:
     st.markdown(
         "Dieses Diagramm zeigt die Gesamtwerte der verschiedenen Krabbler-Klassen, die wir seit Beginn unserer Messungen beobachtet haben. Was sind Krabbler-Klassen? Das ist das, was wir schon können. Unser KI-Modell lernt noch. Wir zählen zum Beispiel alle Käfer, die keine Marienkäfer sind. Denn Marienkäfer erkennen wir schon. Ähnlich ist es bei den Wanzen (die keine Streifenwanzen sind). Streifenwanzen erkennt die Kamera auch schon sehr sicher."
     )
-    # Aggregiere die Daten, um die Gesamtzahl der Beobachtungen pro Insektenklasse zu erhalten.
-    total_label_counts = data["top1"].value_counts()
-
-    # Erstellen eines DataFrames für die Visualisierung
-    total_label_df = pd.DataFrame(total_label_counts).reset_index()
+    # Gesamtzahl der Beobachtungen pro Insektenklasse, vom Server vorberechnet
+    total_label_df = class_totals[["top1", "count"]].sort_values("count", ascending=False)
     total_label_df.columns = ["Insektenklasse", "Anzahl"]
 
     # Erstellen des Bar-Charts mit Altair
@@ -714,9 +665,9 @@ with tab2:
         "Manche Insekten sind morgens aktiv, andere abends oder nachts. In dieser **Heatmap** kannst du die **Aktivitätszeiten** der verschiedenen Krabbler ablesen."
     )
     # Create a heatmap showing the distribution of insect categories over the hours of the day.
-    # Create a dedicated dataframe for the heatmap with the count of each insect category per hour.
+    # The count of each insect category per hour is pre-aggregated by the backend.
     # Use the make_heatmap function to create the heatmap with Altair and display it with st.altair_chart.
-    heatmap_df = data.groupby(["top1", "hour"]).size().reset_index(name="count")
+    heatmap_df = load_stats("heatmap", ["top1", "hour", "count"])
     heatmap = make_heatmap(heatmap_df, "top1", "hour", "count", "greens")
     st.altair_chart(heatmap, use_container_width=True)
 
@@ -730,7 +681,7 @@ with tab2:
     )
 
     # Berechnen der durchschnittlichen Zeit pro Insektenart für die Gesamtdaten
-    avg_duration_data = data.groupby("top1")[DURATION_COLUMN].mean().reset_index()
+    avg_duration_data = class_totals[["top1", "mean_duration_s"]].copy()
     avg_duration_data.columns = ["Insektenart", "Durchschnittliche Zeit (s)"]
 
     # Erstellen des Scatter-Charts mit Altair
@@ -0,0 +1,263 @@
+"""Cached access to the API of the FastAPI service, shared by all dashboard pages.
+
+All requests go through one pooled `requests.Session` with keep-alive connections.
+The classification data is kept in memory and refreshed incrementally (only rows
+newer than the last known row id) by a background thread, so a rerun of a page
+never waits for the full history. Small JSON responses are cached with a TTL and
+thumbnails are cached on disk below `data/` with a size limit.
+"""
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import requests
+import streamlit as st
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+load_dotenv()
+
+DATA_ENDPOINT = os.getenv("DATA_ENDPOINT", "http://fastapi:8000")
+API_KEY = os.getenv("API_KEY")
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# Seconds between background refreshes of the classification data and TTL of the cached responses
+REFRESH_INTERVAL_S = float(os.getenv("REFRESH_INTERVAL_S") or 30)
+IMAGE_CACHE_PATH = Path("data")
+IMAGE_CACHE_MAX_MB = int(os.getenv("IMAGE_CACHE_MAX_MB") or 100)
+# Requested thumbnail size, the API serves the nearest of its THUMBNAIL_SIZES
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE") or 256)
+
+
+@st.cache_resource
+def get_session():
+    # One connection pool for all pages and sessions of the dashboard
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.5, allowed_methods=["GET"]),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["access_token"] = API_KEY
+    return session
+
+
+def get(path, **kwargs):
+    response = get_session().get(f"{DATA_ENDPOINT}{path}", timeout=60, **kwargs)
+    response.raise_for_status()
+    return response
+
+
+class ClassificationData:
+    """In-memory copy of the classification data, kept up to date in the background."""
+
+    def __init__(self, refresh_interval_s):
+        self.refresh_interval_s = refresh_interval_s
+        self._data = None
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def get(self):
+        # Current data frame, the first call loads the full history
+        with self._lock:
+            if self._data is None:
+                self._data = self._fetch()
+                self._last_id = int(self._data["id"].max()) if len(self._data) else 0
+            if self._thread is None and self.refresh_interval_s > 0:
+                self._thread = threading.Thread(
+                    target=self._refresh_periodically,
+                    name="classification-refresh",
+                    daemon=True,
+                )
+                self._thread.start()
+            return self._data.copy()
+
+    def _fetch(self, since=None):
+        # Rows with an id larger than since, all rows if since is None
+        response = get(
+            "/data/classification",
+            params={"since": since} if since is not None else {},
+            headers={"Accept": ARROW_MEDIA_TYPE},
+        )
+        rows = pa.ipc.open_stream(response.content).read_pandas()
+        # top1 is sent categorical, use plain strings so counts don't include absent classes
+        rows["top1"] = rows["top1"].astype(object)
+        return rows
+
+    def _refresh(self):
+        # Append the rows stored since the last refresh. The request runs without the lock, so get()
+        # keeps answering with the current data while the API is slow
+        rows = self._fetch(self._last_id)
+        if len(rows):
+            with self._lock:
+                self._data = pd.concat([self._data, rows], ignore_index=True)
+                self._last_id = int(rows["id"].max())
+
+    def _refresh_periodically(self):
+        while True:
+            time.sleep(self.refresh_interval_s)
+            try:
+                self._refresh()
+            except requests.RequestException:
+                pass  # keep the data of the last successful refresh
+
+
+@st.cache_resource
+def _classification_data():
+    return ClassificationData(REFRESH_INTERVAL_S)
+
+
+def load_classifications():
+    return _classification_data().get()
+
+
+@st.cache_data(ttl=REFRESH_INTERVAL_S, show_spinner=False)
+def load_stats(name, **params):
+    return get(f"/stats/{name}", params=params).json()
+
+
+@st.cache_data(ttl=REFRESH_INTERVAL_S, show_spinner=False)
+def most_recent_insects():
+    return get("/data/most_recent_insects").json()
+
+
+@st.cache_data(ttl=REFRESH_INTERVAL_S, show_spinner=False)
+def most_recent_insect():
+    return get("/data/most_recent_insect").json()
+
+
+@st.cache_data(ttl=REFRESH_INTERVAL_S, show_spinner=False)
+def tracking_runs():
+    return get("/data/tracking_runs").json()
+
+
+@st.cache_data(ttl=REFRESH_INTERVAL_S, show_spinner=False)
+def tracking_run_details():
+    return get("/data/tracking_runs", params={"details": "true"}).json()
+
+
+@st.cache_data(ttl=REFRESH_INTERVAL_S, show_spinner=False)
+def list_images(date, run_id, offset=0, limit=0):
+    # Page of the image names of a tracking run in capture order, "total" is the number of images of the run
+    return get(
+        f"/data/{date}/{run_id}/images", params={"offset": offset, "limit": limit}
+    ).json()
+
+
+def download_all(on_progress=None, chunk_size=1024 * 1024):
+    # Stream the archive of all data from the API into a temporary file and return its path,
+    # the caller deletes the file. on_progress(received bytes, expected bytes) is called per chunk,
+    # the archive size is estimated from the size of the stored images as it is not known before
+    # the archive is complete.
+    expected = sum(
+        run["bytes"] for runs in tracking_run_details().values() for run in runs
+    )
+    received = 0
+    with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as archive:
+        try:
+            with get("/data/all", stream=True) as response:
+                for chunk in response.iter_content(chunk_size):
+                    archive.write(chunk)
+                    received += len(chunk)
+                    if on_progress is not None:
+                        on_progress(received, max(expected, received))
+        except BaseException:
+            os.remove(archive.name)
+            raise
+    return archive.name
+
+
+class ImageCache:
+    """Thumbnails on disk, the least recently used ones are deleted above `max_bytes`.
+
+    The cached files and their sizes are kept in memory in the order they were
+    used, so the directory is only listed on the first access. The modification
+    time of a file is its last use, which restores the order after a restart.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._files = None  # path -> size, least recently used first
+        self._bytes = 0
+
+    def get(self, path, fetch):
+        # Content of the cached file at directory/path, fetched and stored if missing
+        path = Path(self.directory, path)
+        with self._lock:
+            self._load_index()
+            if path in self._files:
+                self._files.move_to_end(path)
+        try:
+            content = path.read_bytes()
+            os.utime(path)
+            return content
+        except FileNotFoundError:
+            pass
+        content = fetch()  # without the lock, other thumbnails can be served meanwhile
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+        with self._lock:
+            self._bytes += len(content) - self._files.pop(path, 0)
+            self._files[path] = len(content)
+            while self._bytes > self.max_bytes and len(self._files) > 1:
+                oldest, size = self._files.popitem(last=False)
+                oldest.unlink(missing_ok=True)
+                self._bytes -= size
+        return content
+
+    def _load_index(self):
+        if self._files is not None:
+            return
+        files = []
+        for path in self.directory.rglob("*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.is_file():
+                files.append((stat.st_mtime, path, stat.st_size))
+        self._files = OrderedDict((path, size) for _, path, size in sorted(files))
+        self._bytes = sum(self._files.values())
+
+
+@st.cache_resource
+def _image_cache():
+    return ImageCache(IMAGE_CACHE_PATH, IMAGE_CACHE_MAX_MB * 1024 * 1024)
+
+
+def load_thumbnails(date, run_id, images, size=THUMBNAIL_SIZE):
+    # (image name, thumbnail) of the given images of a run
+    return [
+        (
+            image,
+            _image_cache().get(
+                Path("thumbnails", date, run_id, str(size), image),
+                lambda: get(
+                    f"/data/{date}/{run_id}/thumbnails/{image}", params={"size": size}
+                ).content,
+            ),
+        )
+        for image in images
+    ]
+
+
+def load_snapshot(date, run_id, size=THUMBNAIL_SIZE):
+    # Thumbnail of a representative image of a run, None if the run has no images
+    try:
+        return _image_cache().get(
+            Path("snapshots", date, str(size), run_id),
+            lambda: get(f"/data/{date}/{run_id}/snapshot", params={"size": size}).content,
+        )
+    except requests.HTTPError:
+        return None
@@ -1,30 +1,15 @@
 from datetime import datetime
-import io
 import math
-from pathlib import Path
-import shutil
-import zipfile
 import streamlit as st
-import pandas as pd
-import numpy as np
-import altair as alt
-import requests
 import os
 import json
 
 from dotenv import load_dotenv
 
+import data_access
+
 load_dotenv()
 
-CLASSIFICATION_DATA_ENDPOINT = (
-    f"{os.getenv('DATA_ENDPOINT', 'http://fastapi:8000')}/data/classification"
-)
-DATA_ALL_ENDPOINT = f"{os.getenv('DATA_ENDPOINT', 'http://fastapi:8000')}/data/all"
-TRACKING_RUNS_ENDPOINT = (
-    f"{os.getenv('DATA_ENDPOINT', 'http://fastapi:8000')}/data/tracking_runs"
-)
-IMAGE_ENDPOINT = f"{os.getenv('DATA_ENDPOINT', 'http://fastapi:8000')}/data"
-API_KEY = os.getenv("API_KEY")
 CAMERA_NAME = os.getenv("CAMERA_NAME", "waskrabbeltda")
 
 EXCLUDE_CLASSES = ["none_dirt", "none_bg", "none_dirt", "none_shadow"]
@@ -93,18 +78,13 @@ def translate_label(label):
 # Load data with caching, column renaming and data type conversions.
 # Create additionally needed data columns here.
 def load_data():
-    response = requests.get(
-        CLASSIFICATION_DATA_ENDPOINT, headers={"access_token": API_KEY}
-    )
-    data = response.json()
-    data = pd.DataFrame(data)
+    # Cached copy of the classification data, refreshed incrementally in the background
+    data = data_access.load_classifications()
 
     lowercase = lambda x: str(x).lower()
     data.rename(lowercase, axis='columns', inplace=True)
 
-    # Convert columns to datetime and add hour column
-    data[START_TIME_COLUMN] = pd.to_datetime(data[START_TIME_COLUMN], format='mixed')
-    data[END_TIME_COLUMN] = pd.to_datetime(data[END_TIME_COLUMN], format='mixed')
+    # Add hour column
     data["hour"] = data[START_TIME_COLUMN].dt.hour
 
     # Remove observations which are not classified as insects
@@ -149,18 +129,28 @@ with columns[0]:
     mime="text/csv",
     )  
 
-    # Display download button for images. Potential TODO: make this more efficient.
-    # TODO: Remove ZIP file after download
-    zip_file_name = shutil.make_archive(
-        f"waskrabbeltda_data_{datetime.today().strftime('%Y-%m-%d')}", "zip", "data"
-    )
-    with open(zip_file_name, "rb") as zip_file:
-        st.download_button(
-            label="Download all images",
-            data=zip_file,
-            file_name=f"{datetime.now().strftime('%Y_%m_%d-%H-%M-%S')}-{CAMERA_NAME}-images.zip",
-            mime="application/zip",
-        )
+    # Download all images only on request. The archive is streamed from the API into a temporary file
+    # with a progress bar, rendering the page doesn't depend on the amount of data. The button is shown
+    # once and the file deleted afterwards, later reruns neither resend the archive nor keep it in the session.
+    if st.button("Prepare download of all images"):
+        progress = st.progress(0.0, text="Downloading images from the API ...")
+
+        def report_progress(received, expected):
+            progress.progress(received / expected, text=f"{received / 1e6:.1f} of ~{expected / 1e6:.1f} MB")
+
+        st.session_state["images_zip"] = data_access.download_all(report_progress)
+        progress.empty()
+
+    images_zip = st.session_state.pop("images_zip", None)
+    if images_zip is not None:
+        with open(images_zip, "rb") as archive:
+            st.download_button(
+                label="Download all images",
+                data=archive,
+                file_name=f"{datetime.now().strftime('%Y_%m_%d-%H-%M-%S')}-{CAMERA_NAME}-images.zip",
+                mime="application/zip",
+            )
+        os.remove(images_zip)
 
 # Column 2: Display visualizations, stacked on top of each other.
 with columns[1]:
@@ -173,41 +163,26 @@ with columns[1]:
 # Image Gallery
 st.title("Image Gallery")
 
-tracking_runs = requests.get(
-    TRACKING_RUNS_ENDPOINT, headers={"access_token": API_KEY}
-).json()
+tracking_runs = data_access.tracking_runs()
 days_with_images = sorted(list(tracking_runs.keys()))[::-1]
 # Select day
 selections = st.columns(2)
 with selections[0]:
     selected_day = st.selectbox('Wähle einen Tag aus', days_with_images, index=0)
 with selections[1]:
-    day_tracking_runs = sorted(
-        tracking_runs[selected_day], key=lambda run_name: run_name[-8:]
-    )
+    # Runs are listed ordered by end time
+    day_tracking_runs = tracking_runs[selected_day]
     selected_run = st.selectbox('Wähle einen Tracking Run aus', day_tracking_runs)
 
-# Query images, store and display
-images_path = Path("data", selected_day, selected_run)
-if not images_path.exists():
-    images_path.mkdir(parents=True)
-    # get zip file with all images for selected run
-    images_endpoint = f"{IMAGE_ENDPOINT}/{selected_day}/{selected_run}"
-    zip_images_response = requests.get(
-        images_endpoint, headers={"access_token": API_KEY}
-    )
-    zip_images = zipfile.ZipFile(io.BytesIO(zip_images_response.content))
-    zip_images.extractall(images_path)
-
-# Show images
-files = os.listdir(images_path) 
+# Query the number of images, the images themselves are loaded page by page
+image_count = data_access.list_images(selected_day, selected_run)["total"]
 
 controls = st.columns(4)
 with controls[0]:
     batch_size = st.select_slider("Batch size:",range(10,30,5))
 with controls[1]:
     row_size = st.select_slider("Row size:", range(1,6), value = 5)
-num_batches = math.ceil(len(files)/batch_size)
+num_batches = max(math.ceil(image_count/batch_size), 1)
 with controls[2]:
     page = st.selectbox("Page", range(1, num_batches + 1))
 with controls[3]:
@@ -221,11 +196,12 @@ with controls[3]:
     else:
         st.write("No classification data available for this run.")
 
-batch = files[(page-1)*batch_size : page*batch_size]
+# Show only the images of the visible page
+batch = data_access.list_images(selected_day, selected_run, offset=(page-1)*batch_size, limit=batch_size)["images"]
 
 grid = st.columns(row_size)
 col = 0
-for image in batch:
+for image, thumbnail in data_access.load_thumbnails(selected_day, selected_run, batch):
     with grid[col]:
-        st.image(f'{images_path}/{image}', caption=image.split('.')[0], use_column_width=True)   
+        st.image(thumbnail, caption=image.split('.')[0], use_column_width=True)   
     col = (col + 1) % row_size